@@ -1,11 +1,91 @@
 import sys
+import os
 import argparse
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
 import time
 import zipfile
+import threading
+import queue
+from collections import OrderedDict, deque
 
 KMER_SIZE = 48
 ERROR_THRESHOLD = 2
 
+# the number of reads that get_frequent_kmers_packed packs at a time
+PACKED_CHUNK_SIZE = 100000
+
+# maps each base to a base-4 digit so that a seed can be 2-bit encoded with int(seed, 4)
+SEED_DIGITS = str.maketrans('ACGT', '0123')
+
+# maps each base (as an ASCII byte) to its 2-bit code; any other character maps to 4
+BASE_TO_CODE = np.full(256, 4, dtype=np.uint8)
+BASE_TO_CODE[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+
+# maps each 2-bit base code back to its base
+CODE_TO_BASE = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+# maps each base code of a reference parsed as codes (see parse_ref_file) back to its base, with 4 going to N
+CODE_TO_ASCII = np.frombuffer(b'ACGTN', dtype=np.uint8)
+
+# an odd 64-bit constant used to hash the two words of a packed kmer into one (and to hash seeds into the order
+# that minimizers are picked in)
+KMER_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# the biggest 64-bit hash, given to seeds that can't be encoded so that they're never minimizers
+MAX_SEED_HASH = (1 << 64) - 1
+
+# the number of bases in each 64-bit word of a packed reference (see pack_reference)
+WORD_BASES = 32
+
+# the low bit of every 2-bit base in a 64-bit word, used to fold the two bits of each base into one
+LOW_BITS = int('01' * WORD_BASES, 2)
+
+# the number of bytes of the reference file that parse_ref_file reads at a time
+REF_BLOCK_SIZE = 1 << 24
+
+# the whitespace that parse_ref_file strips from the reference (the ASCII whitespace that str.strip strips)
+REF_WHITESPACE = b' \t\n\r\x0b\x0c'
+
+# the default seed pattern: a contiguous seed the size of each of the ERROR_THRESHOLD + 1 parts of a kmer
+DEFAULT_SEED_PATTERN = '1' * int(KMER_SIZE / (ERROR_THRESHOLD + 1))
+
+# choose_seed_size picks seeds that are expected to occur at random fewer than once per this many seeds
+SEED_SELECTIVITY = 16
+
+# the number of alignments that add_to_pileup adds to the pileup at a time
+PILEUP_BATCH_SIZE = 20000
+
+# call_pileup_snps only calls a SNP that at least SNP_MIN_ALLELE_FRACTION of the reads at its index support, which
+# drops most of the mismatches from misaligned reads without dropping any real SNPs in the practice data
+# there's no minimum depth by default: the depth is never below the support that's required anyway, and at the
+# coverage of the practice data a minimum depth of 3 already drops real SNPs
+SNP_MIN_ALLELE_FRACTION = 0.3
+SNP_MIN_DEPTH = 0
+
+# the number of kmers or reads that iter_seeds finds the minimizers of at a time
+MINIMIZER_BATCH_SIZE = 10000
+
+# the number of read pairs that both reads are aligned against the whole genome for in paired mode, to learn the
+# insert size from
+INSERT_TRAINING_PAIRS = 1000
+
+# how many interquartile ranges of the learned insert offsets the insert window extends past the quartiles
+INSERT_WINDOW_IQRS = 1.5
+
+# with --pipeline: the number of read pairs in each chunk (unless --chunkSize is given), the number of chunks that
+# the reader thread can get ahead by, and the number of chunks that can be queued up for each worker process
+PIPELINE_CHUNK_SIZE = 10000
+PIPELINE_QUEUE_SIZE = 4
+PIPELINE_TASKS_PER_WORKER = 2
+
+# with --checkpoint: the number of read pairs in each chunk in read and paired mode (unless --chunkSize is given),
+# and the number of kmers that are aligned between checkpoints in kmer mode
+CHECKPOINT_CHUNK_SIZE = 10000
+CHECKPOINT_BATCH_SIZE = 100000
+
 def parse_reads_file(reads_fn):
     """
     :param reads_fn: the file containing all of the reads
@@ -31,45 +111,537 @@ def parse_reads_file(reads_fn):
         print("Could not read file: ", reads_fn)
         return None
 
-def parse_ref_file(ref_fn):
+def parse_reads_file_chunks(reads_fn, chunk_size):
+    """
+    :param reads_fn: the file containing all of the reads
+    :param chunk_size: the number of paired-end reads in each chunk
+    :return: a generator of lists of (at most chunk_size) paired-end reads, so that only one chunk of the reads
+             file has to be in memory at a time
+    """
+    with open(reads_fn, 'r') as rFile:
+        print("Parsing Reads")
+        first_line = True
+        chunk = []
+        for line in rFile:
+            if first_line:
+                first_line = False
+                continue
+            chunk.append(line.strip().split(','))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def parse_ref_file(ref_fn, output_type='str'):
     """
     :param ref_fn: the file containing the reference genome
-    :return: a string containing the reference genome
+    :param output_type: the type to return the reference genome as: 'str', 'bytes', 'bytearray', or 'codes' (a NumPy
+                        array of base codes, see BASE_TO_CODE, where any base other than A/C/G/T is a 4)
+    :return: the reference genome, as output_type
+
+    The file is read in large blocks and the whitespace is stripped from each block in one pass, so this takes
+    linear time and about one byte of memory per base, even for multi-hundred-megabase chromosomes.
+    The bytearray and the codes are returned as they're parsed, so they never need a second copy of the genome (a str
+    or bytes needs one while it's made). Every stage downstream accepts any of the types, and slices
+    of bytes, a bytearray or the codes are taken without copying the rest of the genome (see get_reference_section).
     """
     try:
-        with open(ref_fn, 'r') as gFile:
+        with open(ref_fn, 'rb') as gFile:
             print("Parsing Ref")
-            first_line = True
-            ref_genome = ''
-            for line in gFile:
-                if first_line:
-                    first_line = False
-                    continue
-                ref_genome += line.strip()
-        return ref_genome
+            # skip the header line
+            gFile.readline()
+            # for codes, each block is turned into codes in the same pass that strips the whitespace
+            table = BASE_TO_CODE.tobytes() if output_type == 'codes' else None
+            ref_genome = bytearray()
+            for block in iter(lambda: gFile.read(REF_BLOCK_SIZE), b''):
+                ref_genome += block.translate(table, REF_WHITESPACE)
     except IOError:
         print("Could not read file: ", ref_fn)
         return None
 
+    if output_type == 'bytearray':
+        return ref_genome
+    elif output_type == 'bytes':
+        return bytes(ref_genome)
+    elif output_type == 'codes':
+        # a view of the bytearray (which the array keeps alive)
+        return np.frombuffer(ref_genome, dtype=np.uint8)
+    else:
+        return ref_genome.decode('ascii')
+
 """
     TODO: Use this space to implement any additional functions you might need
 """
 
 # maps each kmer in a reference genome to the positions that it occurs
+# (each kmer is a seed of the seed layout, see set_seed_layout)
+# the reference can be any type from parse_ref_file: it's turned into a str REF_BLOCK_SIZE bases at a time
 def index_genome(reference):
     index = {}
 
-    part_size = int(KMER_SIZE / 3)
+    part_size = len(seed_layout['pattern'])
 
-    for i in range(len(reference) - part_size + 1):
-        kmer = reference[i:(i + part_size)]
-        if kmer in index:
-            index[kmer].append(i)
-        else:
-            index[kmer] = [i]
+    # with a contiguous seed and no minimizer window (the default), every position is indexed, and its seed is
+    # sliced straight out of the block
+    if seed_layout['contiguous'] and seed_layout['window'] is None:
+        for block_start in range(0, len(reference), REF_BLOCK_SIZE):
+            block = get_reference_section(reference, block_start, block_start + REF_BLOCK_SIZE + part_size - 1)
+            for j in range(min(REF_BLOCK_SIZE, len(block) - part_size + 1)):
+                kmer = block[j:(j + part_size)]
+                if kmer in index:
+                    index[kmer].append(block_start + j)
+                else:
+                    index[kmer] = [block_start + j]
+        return index
+
+    # with a minimizer window, only the minimizers are indexed (see get_minimizer_offsets)
+    if seed_layout['window'] is not None:
+        seed_starts = get_minimizer_offsets(*get_seed_codes(reference, seed_layout['seed_offsets']))
+    else:
+        seed_starts = np.arange(len(reference) - part_size + 1)
+
+    # otherwise, the seeds are spaced or only the minimizers are indexed, and each seed is taken with get_seed
+    for block_start in range(0, len(reference), REF_BLOCK_SIZE):
+        block = get_reference_section(reference, block_start, block_start + REF_BLOCK_SIZE + part_size - 1)
+        first, last = np.searchsorted(seed_starts, [block_start, block_start + REF_BLOCK_SIZE])
+        for i in seed_starts[first:last].tolist():
+            kmer = get_seed(block, i - block_start)
+            if kmer in index:
+                index[kmer].append(i)
+            else:
+                index[kmer] = [i]
 
     return index
 
+# how kmers, reads and the reference are split into seeds (see set_seed_layout)
+seed_layout = {}
+
+# sets the seed pattern and the # of parts that each kmer or read is split into
+# the pattern has a 1 for each base that's part of the seed and a 0 for each base that's skipped (a spaced seed), so
+# a pattern of all 1s is a contiguous seed; num_parts has to be > ERROR_THRESHOLD for the pigeonhole principle
+# if minimizer_window is given, the index only keeps the (minimizer_window, seed size) minimizers of the reference,
+# and kmers and reads are seeded with their own minimizers instead of one seed per part (see get_minimizers)
+def set_seed_layout(pattern, num_parts, minimizer_window=None):
+    seed_layout['pattern'] = pattern
+    seed_layout['parts'] = num_parts
+    seed_layout['window'] = minimizer_window
+    seed_layout['seed_offsets'] = [i for i, base in enumerate(pattern) if base == '1']
+    seed_layout['contiguous'] = '0' not in pattern
+    seed_layout['short_lengths'] = set()
+
+# by default, each kmer is split into ERROR_THRESHOLD + 1 contiguous seeds
+set_seed_layout(DEFAULT_SEED_PATTERN, ERROR_THRESHOLD + 1)
+
+# returns the smallest seed size that's expected to occur at random in a genome of genome_length bases fewer than
+# once per SEED_SELECTIVITY seeds, but no bigger than max_seed_size
+def choose_seed_size(genome_length, max_seed_size):
+    seed_size = 1
+    while 4 ** seed_size < genome_length * SEED_SELECTIVITY and seed_size < max_seed_size:
+        seed_size += 1
+    return seed_size
+
+# returns the seed starting at offset in a sequence (the bases under the 1s of the seed pattern)
+def get_seed(sequence, offset):
+    if seed_layout['contiguous']:
+        return sequence[offset:(offset + len(seed_layout['pattern']))]
+    return ''.join([sequence[offset + i] for i in seed_layout['seed_offsets']])
+
+# returns the offset of the seed of each part of a kmer or read of the given length
+# a kmer or read with at most ERROR_THRESHOLD mismatches is split into seed_layout['parts'] parts, so at least
+# parts - ERROR_THRESHOLD of them match the reference perfectly, and so does the seed at the start of each of them
+def get_seed_offsets(length):
+    span = len(seed_layout['pattern'])
+    part_size = length // seed_layout['parts']
+    if part_size < span:
+        # the parts are too short for the seed, so only seed the parts that fit
+        # with fewer seeds than parts, a kmer or read with ERROR_THRESHOLD mismatches can miss every seed, so this
+        # is pointed out (once for each length)
+        if length not in seed_layout['short_lengths']:
+            seed_layout['short_lengths'].add(length)
+            print("Warning: sequences of length ", length, " are too short for ", seed_layout['parts'],
+                  " seeds of span ", span, ", so they may not align even with <= ERROR_THRESHOLD mismatches")
+        return list(range(0, length - span + 1, span))
+    return [part * part_size for part in range(seed_layout['parts'])]
+
+# returns the (offset, seed) pairs of a kmer or read (see get_seed_offsets), or its minimizers if the seed layout has
+# a minimizer window
+def get_seeds(sequence):
+    if seed_layout['window'] is not None:
+        return get_minimizers(sequence)
+    return [(offset, get_seed(sequence, offset)) for offset in get_seed_offsets(len(sequence))]
+
+# returns the # of seeds that have to hit a candidate index, out of the num_seeds seeds that were looked up
+# (at most ERROR_THRESHOLD of the seeds can have a mismatch)
+# the minimizers of a kmer or read can overlap each other, so with a minimizer window any hit is a candidate
+def get_min_seed_hits(num_seeds):
+    if seed_layout['window'] is not None:
+        return 1
+    return max(1, num_seeds - ERROR_THRESHOLD)
+
+# returns the hash that minimizers are picked by, for a seed's 2-bit code (or None if it couldn't be encoded)
+# the hash scrambles the order of the seeds, so that low-complexity seeds like AAAA... aren't always the minimizers
+# seeds that couldn't be encoded get the biggest hash, and are never used as minimizers
+def get_seed_hash(seed_code):
+    if seed_code is None:
+        return MAX_SEED_HASH
+    return (seed_code * int(KMER_HASH_MULTIPLIER)) & MAX_SEED_HASH
+
+# returns the (offset, seed) pairs of the minimizers of a kmer or read: the seeds with the smallest hash (see
+# get_seed_hash) in each window of seed_layout['window'] consecutive seeds, with ties going to the leftmost seed
+# a kmer or read that matches the reference in a whole window (window + seed size - 1 bases) shares that window's
+# minimizer with the reference
+def get_minimizers(sequence):
+    span = len(seed_layout['pattern'])
+    num_seeds = max(len(sequence) - span + 1, 0)
+    window = min(seed_layout['window'], num_seeds)
+    if window == 0:
+        return []
+    hashes, valid = get_seed_hashes(sequence)
+
+    # the minimizer only changes when a smaller hash slides into the window, or when the minimizer slides out of it
+    # (and only then does the whole window have to be looked through again)
+    best_offsets = []
+    best = -1
+    best_hash = None
+    for end in range(window - 1, num_seeds):
+        if best <= end - window:
+            best = min(range(end - window + 1, end + 1), key=hashes.__getitem__)
+            best_hash = hashes[best]
+            best_offsets.append(best)
+        elif hashes[end] < best_hash:
+            best = end
+            best_hash = hashes[end]
+            best_offsets.append(best)
+
+    return [(offset, get_seed(sequence, offset)) for offset in best_offsets if valid[offset]]
+
+# returns the seeds (see get_seeds) of each of a list of kmers or reads, in order
+# with a minimizer window, the minimizers of MINIMIZER_BATCH_SIZE sequences at a time are found together with
+# get_minimizer_rows, instead of one sequence at a time in a Python loop
+def iter_seeds(sequences):
+    if seed_layout['window'] is None:
+        for sequence in sequences:
+            yield get_seeds(sequence)
+        return
+
+    for batch_start in range(0, len(sequences), MINIMIZER_BATCH_SIZE):
+        batch = sequences[batch_start:(batch_start + MINIMIZER_BATCH_SIZE)]
+
+        # group the sequences by length so that each group can be turned into one 2D array
+        numbers_by_length = {}
+        for number, sequence in enumerate(batch):
+            numbers_by_length.setdefault(len(sequence), []).append(number)
+
+        batch_seeds = [None] * len(batch)
+        for numbers in numbers_by_length.values():
+            group = [batch[number] for number in numbers]
+            for number, sequence, offsets in zip(numbers, group, get_minimizer_rows(group)):
+                batch_seeds[number] = [(offset, get_seed(sequence, offset)) for offset in offsets]
+        yield from batch_seeds
+
+# the array version of get_minimizers for sequences of the same length, like get_minimizer_offsets: the sequences
+# are joined and encoded with get_seed_codes, the seeds of each sequence are gathered into a row, and the minimizer
+# of every window of every row is found with one argmin
+# returns the offsets of the minimizers of each sequence, in increasing order
+def get_minimizer_rows(sequences):
+    sequence_length = len(sequences[0])
+    num_seeds = max(sequence_length - len(seed_layout['pattern']) + 1, 0)
+    window = min(seed_layout['window'], num_seeds)
+    if window == 0:
+        return [[] for _ in sequences]
+
+    # seed i of sequence k starts at k * sequence_length + i of the joined sequences (seeds that cross into the next
+    # sequence are never gathered)
+    seed_codes, valid = get_seed_codes(''.join(sequences), seed_layout['seed_offsets'])
+    starts = (np.arange(len(sequences)) * sequence_length)[:, np.newaxis] + np.arange(num_seeds)
+    hashes = seed_codes[starts] * KMER_HASH_MULTIPLIER
+    valid = valid[starts]
+    hashes[~valid] = MAX_SEED_HASH
+
+    windows = np.lib.stride_tricks.sliding_window_view(hashes, window, axis=1)
+    best = windows.argmin(axis=2) + np.arange(windows.shape[1])
+    is_minimizer = np.zeros(hashes.shape, dtype=bool)
+    is_minimizer[np.arange(len(sequences))[:, np.newaxis], best] = True
+    is_minimizer &= valid
+
+    rows, offsets = np.nonzero(is_minimizer)
+    row_ends = np.cumsum(np.bincount(rows, minlength=len(sequences)))
+    return [row_offsets.tolist() for row_offsets in np.split(offsets, row_ends[:-1])]
+
+# returns the hash (see get_seed_hash) of the seed at every offset of a short sequence, and whether each seed could
+# be encoded
+# when the seeds are contiguous and the whole sequence can be encoded, the sequence is encoded as one int and each
+# seed's code is shifted out of it, instead of encoding each seed separately
+def get_seed_hashes(sequence):
+    num_seeds = max(len(sequence) - len(seed_layout['pattern']) + 1, 0)
+    sequence_code = None
+    if seed_layout['contiguous'] and num_seeds > 0:
+        sequence_code = encode_seed(sequence)
+
+    if sequence_code is None:
+        seed_codes = [encode_seed(get_seed(sequence, offset)) for offset in range(num_seeds)]
+        return [get_seed_hash(seed_code) for seed_code in seed_codes], [code is not None for code in seed_codes]
+
+    multiplier = int(KMER_HASH_MULTIPLIER)
+    mask = (1 << (2 * len(seed_layout['pattern']))) - 1
+    hashes = [(((sequence_code >> shift) & mask) * multiplier) & MAX_SEED_HASH
+              for shift in range(2 * (num_seeds - 1), -2, -2)]
+    return hashes, [True] * num_seeds
+
+# the array version of get_minimizers for the whole reference, REF_BLOCK_SIZE windows at a time
+# takes the seed codes and valid mask from get_seed_codes, and returns the offsets of the minimizers
+def get_minimizer_offsets(seed_codes, valid):
+    hashes = seed_codes * KMER_HASH_MULTIPLIER
+    hashes[~valid] = MAX_SEED_HASH
+    window = min(seed_layout['window'], len(hashes))
+    if window == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    is_minimizer = np.zeros(len(hashes), dtype=bool)
+    for block_start in range(0, len(hashes) - window + 1, REF_BLOCK_SIZE):
+        block = hashes[block_start:(block_start + REF_BLOCK_SIZE + window - 1)]
+        windows = np.lib.stride_tricks.sliding_window_view(block, window)
+        is_minimizer[block_start + np.arange(len(windows)) + windows.argmin(axis=1)] = True
+
+    return np.flatnonzero(is_minimizer & valid)
+
+# returns the 2-bit encoding of a seed as an int, or None if the seed contains a non-ACGT character
+def encode_seed(seed):
+    try:
+        return int(seed.translate(SEED_DIGITS), 4)
+    except ValueError:
+        return None
+
+# returns the 2-bit encoding of the seed at every offset of a sequence (any type from parse_ref_file), along with a
+# mask of which seeds only contain A/C/G/T (seeds containing any other character can't be encoded)
+# seed_offsets are the offsets of the bases of a seed from its start (range(seed_size) for a contiguous seed)
+def get_seed_codes(sequence, seed_offsets):
+    codes = get_reference_codes(sequence)
+    num_seeds = max(len(codes) - seed_offsets[-1], 0)
+
+    seed_codes = np.zeros(num_seeds, dtype=np.uint64)
+    valid = np.ones(num_seeds, dtype=bool)
+    for i in seed_offsets:
+        window = codes[i:(i + num_seeds)]
+        seed_codes = (seed_codes << np.uint64(2)) | (window & 3).astype(np.uint64)
+        valid &= window < 4
+
+    return seed_codes, valid
+
+# array-backed version of index_genome, using ~10x less memory than the dict of lists
+# returns (seeds, offsets, positions):
+#   seeds: the sorted, distinct 2-bit encoded seeds in the reference
+#   offsets: the positions of seeds[i] are positions[offsets[i]:offsets[i + 1]]
+#   positions: the positions of every seed, grouped by seed and in increasing order within a seed
+def index_genome_array(reference):
+    part_size = len(seed_layout['seed_offsets'])
+
+    # with a minimizer window, only the minimizers are indexed (see get_minimizer_offsets)
+    seed_codes, valid = get_seed_codes(reference, seed_layout['seed_offsets'])
+    if seed_layout['window'] is not None:
+        positions = get_minimizer_offsets(seed_codes, valid)
+    else:
+        positions = np.flatnonzero(valid)
+    seed_codes = seed_codes[positions]
+
+    # a stable sort keeps the positions of each seed in increasing order (like the dict index)
+    order = np.argsort(seed_codes, kind='stable')
+    seed_codes = seed_codes[order]
+    positions = positions[order].astype(np.uint32)
+    del order
+
+    seeds, counts = np.unique(seed_codes, return_counts=True)
+    offsets = np.zeros(len(seeds) + 1, dtype=np.uint32)
+    np.cumsum(counts, out=offsets[1:])
+
+    # a seed of <= 16 bases fits in 32 bits
+    if part_size <= 16:
+        seeds = seeds.astype(np.uint32)
+
+    return seeds, offsets, positions
+
+# writes the array index to index_fn as consecutive .npy arrays, so that it can be memory-mapped later
+def save_index_file(reference_index, index_fn):
+    # write to a temporary file first so that a crashed run never leaves a partial index behind
+    tmp_fn = index_fn + '.tmp'
+    with open(tmp_fn, 'wb') as index_file:
+        for array in reference_index:
+            np.lib.format.write_array(index_file, np.ascontiguousarray(array))
+    os.replace(tmp_fn, index_fn)
+
+# memory-maps an array index written by save_index_file (nothing is copied into memory until it's used)
+def load_index_file(index_fn):
+    arrays = []
+    with open(index_fn, 'rb') as index_file:
+        for _ in range(3):
+            version = np.lib.format.read_magic(index_file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(index_file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(index_file)
+            offset = index_file.tell()
+            arrays.append(np.memmap(index_fn, dtype=dtype, mode='r', offset=offset, shape=shape))
+            index_file.seek(offset + arrays[-1].nbytes)
+
+    return tuple(arrays)
+
+# returns the SHA-1 of the reference genome as a hex string
+# the reference is hashed as ASCII one block at a time, so the hash is the same whatever type it was parsed as
+def get_reference_hash(reference):
+    reference_hash = hashlib.sha1()
+    for block_start in range(0, len(reference), REF_BLOCK_SIZE):
+        reference_hash.update(encode_reference(reference[block_start:(block_start + REF_BLOCK_SIZE)]))
+    return reference_hash.hexdigest()
+
+# returns the array index for the reference genome
+# the index is saved in index_dir, keyed by a hash of the reference (see get_reference_hash) and KMER_SIZE (and the
+# seed pattern, if it isn't the default), so that later runs against the same reference just memory-map it instead
+# of rebuilding it
+def get_cached_index(reference, index_dir):
+    index_name = 'ref_' + get_reference_hash(reference) + '_k' + str(KMER_SIZE)
+    if seed_layout['pattern'] != DEFAULT_SEED_PATTERN:
+        index_name += '_s' + seed_layout['pattern']
+    if seed_layout['window'] is not None:
+        index_name += '_w' + str(seed_layout['window'])
+    index_fn = os.path.join(index_dir, index_name + '.idx')
+
+    if os.path.exists(index_fn):
+        print("Loading Index")
+        return load_index_file(index_fn)
+
+    print("Building Index")
+    reference_index = index_genome_array(reference)
+    os.makedirs(index_dir, exist_ok=True)
+    save_index_file(reference_index, index_fn)
+
+    return reference_index
+
+# returns the positions that a seed occurs at in the reference genome
+# works with both the dict index (index_genome) and the array index (index_genome_array)
+def get_seed_positions(seed, reference_index):
+    if isinstance(reference_index, dict):
+        return reference_index.get(seed, [])
+
+    seeds, offsets, positions = reference_index
+    seed_code = encode_seed(seed)
+    if seed_code is None:
+        return positions[:0]
+
+    # binary search for the seed (the seed must have the array's dtype, otherwise numpy converts the whole array)
+    seed_code = seeds.dtype.type(seed_code)
+    i = seeds.searchsorted(seed_code)
+    if i == len(seeds) or seeds[i] != seed_code:
+        return positions[:0]
+
+    return positions[offsets[i]:offsets[i + 1]]
+
+# the seed hit cache: an LRU cache that maps (seed, offset) to the seed's candidate starts (see
+# get_seed_candidates), the most entries it can hold (None turns the cache off), and how many lookups have hit and
+# missed it and how many entries it has evicted so far
+seed_cache_state = {'cache': OrderedDict(), 'size': None, 'hits': 0, 'misses': 0, 'evictions': 0}
+SEED_CACHE_COUNTS = ('hits', 'misses', 'evictions')
+
+# returns the candidate starts of a seed at an offset of a kmer or read: the seed's positions in the reference
+# minus the offset, leaving out any starts before the beginning of the reference
+# the same seed at the same offset turns up in many kmers and reads from the same region, so when the seed hit cache
+# is on, the candidate starts are kept in it and reused (the cached lists must not be changed by the caller)
+def get_seed_candidates(seed, offset, reference_index):
+    cache = seed_cache_state['cache']
+    if seed_cache_state['size'] is not None:
+        candidates = cache.get((seed, offset))
+        if candidates is not None:
+            cache.move_to_end((seed, offset))
+            seed_cache_state['hits'] += 1
+            return candidates
+        seed_cache_state['misses'] += 1
+
+    positions = get_seed_positions(seed, reference_index)
+    if isinstance(positions, list):
+        candidates = [(position - offset) for position in positions if position >= offset]
+    else:
+        starts = positions.astype(np.int64) - offset
+        candidates = starts[starts >= 0].tolist()
+
+    if seed_cache_state['size'] is not None:
+        cache[(seed, offset)] = candidates
+        if len(cache) > seed_cache_state['size']:
+            cache.popitem(last=False)
+            seed_cache_state['evictions'] += 1
+
+    return candidates
+
+# the seed cap (the most positions that a seed can have before it's considered over-represented), and how many
+# seeds and candidate indices get_capped_seed_positions has pruned so far
+seed_cap_state = {'cap': None, 'seeds_skipped': 0, 'seeds_sampled': 0, 'candidates_pruned': 0}
+SEED_CAP_COUNTS = ('seeds_skipped', 'seeds_sampled', 'candidates_pruned')
+
+# looks up a list of (offset, seed) pairs, returning (offset, candidate starts) pairs for the seeds that are kept
+# (see get_seed_candidates)
+# seeds with more positions than the seed cap (like the seeds in a tandem repeat) are skipped, as long as some other
+# seed is kept; if all of the seeds are over the cap, only the least frequent one is kept, down-sampled to at most
+# cap evenly spaced positions
+def get_capped_seed_positions(seeds, reference_index):
+    seed_positions = [(offset, get_seed_candidates(seed, offset, reference_index)) for offset, seed in seeds]
+    cap = seed_cap_state['cap']
+    if cap is None:
+        return seed_positions
+
+    kept = [(offset, positions) for offset, positions in seed_positions if len(positions) <= cap]
+    if kept:
+        seed_cap_state['seeds_skipped'] += len(seed_positions) - len(kept)
+        seed_cap_state['candidates_pruned'] += sum(len(positions) for _, positions in seed_positions) - \
+            sum(len(positions) for _, positions in kept)
+        return kept
+
+    if not seed_positions:
+        return seed_positions
+    offset, positions = min(seed_positions, key=lambda seed: len(seed[1]))
+    sampled = positions[::-(-len(positions) // cap)]
+    seed_cap_state['seeds_skipped'] += len(seed_positions) - 1
+    seed_cap_state['seeds_sampled'] += 1
+    seed_cap_state['candidates_pruned'] += sum(len(positions) for _, positions in seed_positions) - len(sampled)
+    return [(offset, sampled)]
+
+# how many reads (or read pairs) dedup_reads has been given so far, and how many of them were distinct
+dedup_state = {'reads': 0, 'distinct_reads': 0}
+DEDUP_COUNTS = ('reads', 'distinct_reads')
+
+# collapses identical reads into a dictionary that maps each distinct read to its multiplicity (the amount of times
+# it appears), in the order that the reads first appear in
+# read pairs have to be given as tuples
+def dedup_reads(reads):
+    read_to_multiplicity = {}
+    for read in reads:
+        if read in read_to_multiplicity:
+            read_to_multiplicity[read] += 1
+        else:
+            read_to_multiplicity[read] = 1
+
+    dedup_state['reads'] += len(reads)
+    dedup_state['distinct_reads'] += len(read_to_multiplicity)
+    return read_to_multiplicity
+
+# streaming version of STEPS 2-4 (before the frequency filter): reads the reads file one chunk at a time,
+# flattening the read pairs, breaking the reads into kmers and counting the kmers chunk by chunk
+# peak memory depends on the number of distinct kmers rather than on the size of the reads file
+# if dedup is True, the identical reads in each chunk are collapsed first (see get_weighted_kmer_frequencies), and
+# if prefetch is True, the next chunks are read while the current one is counted (see prefetch_chunks)
+def get_kmer_frequencies_streaming(reads_fn, chunk_size, dedup=False, prefetch=False):
+    kmer_to_frequency = {}
+
+    try:
+        for reads in parse_flattened_reads_chunks(reads_fn, chunk_size, prefetch):
+            if dedup:
+                get_weighted_kmer_frequencies(dedup_reads(reads), kmer_to_frequency)
+            else:
+                get_kmer_frequencies(break_into_kmers(reads), kmer_to_frequency)
+    except IOError:
+        print("Could not read file: ", reads_fn)
+        return None
+
+    return kmer_to_frequency
+
 # breaks down the reads into kmers
 def break_into_kmers(reads):
     kmers = []
@@ -81,8 +653,10 @@ def break_into_kmers(reads):
     return kmers
 
 # returns a dictionary that maps each read to the amount of times it appears
-def get_kmer_frequencies(kmers):
-    kmer_to_frequency = {}
+# if kmer_to_frequency is given, the counts are added to it instead of to a new dictionary
+def get_kmer_frequencies(kmers, kmer_to_frequency=None):
+    if kmer_to_frequency is None:
+        kmer_to_frequency = {}
 
     for kmer in kmers:
         if kmer in kmer_to_frequency:
@@ -92,53 +666,283 @@ def get_kmer_frequencies(kmers):
 
     return kmer_to_frequency
 
+# deduplicated version of STEPS 3-4 (before the frequency filter): each distinct read (from dedup_reads) is broken
+# into kmers once, and each of its kmers is counted as many times as the read appears
+# the kmers and their frequencies come out the same as get_kmer_frequencies(break_into_kmers(reads))
+def get_weighted_kmer_frequencies(read_to_multiplicity, kmer_to_frequency=None):
+    if kmer_to_frequency is None:
+        kmer_to_frequency = {}
+
+    for read, multiplicity in read_to_multiplicity.items():
+        for i in range(len(read) - KMER_SIZE + 1):
+            kmer = read[i:(i + KMER_SIZE)]
+            if kmer in kmer_to_frequency:
+                kmer_to_frequency[kmer] += multiplicity
+            else:
+                kmer_to_frequency[kmer] = multiplicity
+
+    return kmer_to_frequency
+
+# packs every kmer of the reads into two uint64 words, 2 bits per base: the first KMER_SIZE - KMER_SIZE // 2
+# bases go in the high word and the last KMER_SIZE // 2 bases go in the low word (so KMER_SIZE can be up to 64)
+# kmers that contain a base other than A/C/G/T can't be packed, so they're skipped
+# returns (high words, low words, kmer indices), where the kmer index of a kmer is its index in
+# break_into_kmers(reads), plus first_kmer_index
+def pack_kmers(reads, first_kmer_index=0):
+    high_size = KMER_SIZE - KMER_SIZE // 2
+
+    # the kmer index of the first kmer of each read
+    read_lengths = np.array([len(read) for read in reads], dtype=np.int64)
+    kmers_per_read = np.maximum(read_lengths - KMER_SIZE + 1, 0)
+    read_kmer_indices = first_kmer_index + np.cumsum(kmers_per_read) - kmers_per_read
+
+    all_high, all_low, all_kmer_indices = [], [], []
+
+    # the reads are packed in groups of the same length, so that each group is a 2D array of base codes
+    # (stored as base position x read, so that each step below works on contiguous rows)
+    for read_length in np.unique(read_lengths[kmers_per_read > 0]).tolist():
+        read_numbers = np.flatnonzero(read_lengths == read_length)
+        codes = BASE_TO_CODE[np.frombuffer(''.join([reads[i] for i in read_numbers]).encode('ascii'),
+                                           dtype=np.uint8)].reshape(len(read_numbers), read_length)
+        codes = np.ascontiguousarray(codes.T)
+        base_codes = (codes & 3).astype(np.uint64)
+        num_kmers = read_length - KMER_SIZE + 1
+
+        # roll the encoding across each read, one base position of the kmer at a time
+        high = np.zeros((num_kmers, len(read_numbers)), dtype=np.uint64)
+        low = np.zeros((num_kmers, len(read_numbers)), dtype=np.uint64)
+        valid = np.ones((num_kmers, len(read_numbers)), dtype=bool)
+        for i in range(KMER_SIZE):
+            word = high if i < high_size else low
+            word <<= np.uint64(2)
+            word |= base_codes[i:(i + num_kmers)]
+            valid &= codes[i:(i + num_kmers)] < 4
+
+        # transpose back so the kmers come out read by read, like in break_into_kmers
+        high = np.ascontiguousarray(high.T).ravel()
+        low = np.ascontiguousarray(low.T).ravel()
+        kmer_indices = (read_kmer_indices[read_numbers][:, None] + np.arange(num_kmers)).ravel()
+        valid = np.ascontiguousarray(valid.T).ravel()
+        if not valid.all():
+            high, low, kmer_indices = high[valid], low[valid], kmer_indices[valid]
+
+        all_high.append(high)
+        all_low.append(low)
+        all_kmer_indices.append(kmer_indices)
+
+    if not all_high:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+
+    return np.concatenate(all_high), np.concatenate(all_low), np.concatenate(all_kmer_indices)
+
+# the packed version of get_kmer_frequencies: sorts the packed kmers (from pack_kmers) and counts equal kmers
+# returns (high words, low words, first kmer indices, counts) with one entry per distinct kmer,
+# where the first kmer index of a kmer is the smallest kmer index it had
+# if counts is given, each input kmer counts that many times, which is how the counts of two chunks are merged
+def count_packed_kmers(high, low, kmer_indices, counts=None):
+    if counts is None:
+        counts = np.ones(len(high), dtype=np.int64)
+    if len(high) == 0:
+        return high, low, kmer_indices, counts
+
+    # sort by a 64-bit hash of the two words, which is several times faster than a lexsort on both of them
+    hashes = high * KMER_HASH_MULTIPLIER + low
+    order = np.argsort(hashes)
+    hashes, high, low, kmer_indices, counts = hashes[order], high[order], low[order], kmer_indices[order], counts[order]
+
+    is_first = np.ones(len(high), dtype=bool)
+    is_first[1:] = hashes[1:] != hashes[:-1]
+
+    # in the (very unlikely) case that two different kmers have the same hash, sort by both words instead
+    if (~is_first[1:] & ((high[1:] != high[:-1]) | (low[1:] != low[:-1]))).any():
+        order = np.lexsort((low, high))
+        high, low, kmer_indices, counts = high[order], low[order], kmer_indices[order], counts[order]
+        is_first[1:] = (high[1:] != high[:-1]) | (low[1:] != low[:-1])
+
+    starts = np.flatnonzero(is_first)
+    return (high[starts], low[starts], np.minimum.reduceat(kmer_indices, starts),
+            np.add.reduceat(counts, starts))
+
+# turns packed kmers (from pack_kmers) back into strings
+def unpack_kmers(high, low):
+    high_size = KMER_SIZE - KMER_SIZE // 2
+
+    bases = np.empty((len(high), KMER_SIZE), dtype=np.uint8)
+    for i in range(KMER_SIZE):
+        if i < high_size:
+            shift = np.uint64(2 * (high_size - 1 - i))
+            bases[:, i] = CODE_TO_BASE[((high >> shift) & np.uint64(3)).astype(np.intp)]
+        else:
+            shift = np.uint64(2 * (KMER_SIZE - 1 - i))
+            bases[:, i] = CODE_TO_BASE[((low >> shift) & np.uint64(3)).astype(np.intp)]
+
+    all_bases = bases.tobytes().decode('ascii')
+    return [all_bases[i:(i + KMER_SIZE)] for i in range(0, len(all_bases), KMER_SIZE)]
+
+# packed version of STEPS 3-4: counts the kmers of the reads without making a string for every kmer, then removes
+# any kmers with a frequency < min_frequency and turns only the remaining kmers into strings
+# the kmers are returned in the order they first appear in, just like list(get_kmer_frequencies(...).keys())
+# if dedup is True, the identical reads in each chunk are collapsed first (see get_packed_kmer_counts)
+def get_frequent_kmers_packed(reads, min_frequency=2, dedup=False):
+    read_chunks = (reads[i:(i + PACKED_CHUNK_SIZE)] for i in range(0, len(reads), PACKED_CHUNK_SIZE))
+    return select_frequent_packed_kmers(get_packed_kmer_counts(read_chunks, dedup), min_frequency)
+
+# streaming version of get_frequent_kmers_packed that reads, packs and counts the reads file chunk by chunk
+def get_frequent_kmers_packed_streaming(reads_fn, chunk_size, min_frequency=2, dedup=False, prefetch=False):
+    try:
+        packed_counts = get_packed_kmer_counts(parse_flattened_reads_chunks(reads_fn, chunk_size, prefetch), dedup)
+    except IOError:
+        print("Could not read file: ", reads_fn)
+        return None
+
+    return select_frequent_packed_kmers(packed_counts, min_frequency)
+
+# flattens each chunk of read pairs from parse_reads_file_chunks into a list of single reads
+# if prefetch is True, the chunks are read ahead in another thread (see prefetch_chunks)
+def parse_flattened_reads_chunks(reads_fn, chunk_size, prefetch=False):
+    read_pair_chunks = parse_reads_file_chunks(reads_fn, chunk_size)
+    if prefetch:
+        read_pair_chunks = prefetch_chunks(read_pair_chunks)
+
+    count = 0
+    for read_pairs in read_pair_chunks:
+        yield [read for read_pair in read_pairs for read in read_pair]
+        count += len(read_pairs)
+        print(count, " reads done")
+
+# reads the chunks of an iterable (like parse_reads_file_chunks) in a separate thread, so that the next chunks are
+# read from disk while the current one is being worked on
+# at most PIPELINE_QUEUE_SIZE chunks are read ahead, so a slow consumer holds back the reader instead of letting
+# the chunks pile up in memory
+# an error raised while reading (like an IOError) is raised again where the chunks are used
+def prefetch_chunks(chunks):
+    chunk_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    done = object()
+
+    def read_chunks():
+        try:
+            for chunk in chunks:
+                chunk_queue.put(chunk)
+        except Exception as error:
+            chunk_queue.put(error)
+        chunk_queue.put(done)
+
+    threading.Thread(target=read_chunks, daemon=True).start()
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is done:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+# packs and counts the kmers of each chunk of reads, and merges the counts of all of the chunks
+# returns the packed kmer counts (see count_packed_kmers), so peak memory depends on the number of distinct kmers
+# plus the size of one chunk
+# if dedup is True, only the distinct reads of each chunk are packed, and each of their kmers counts as many times
+# as the read appears in the chunk
+def get_packed_kmer_counts(read_chunks, dedup=False):
+    # the counts of each chunk are kept separately until they add up to more entries than the merged counts,
+    # so that the merged counts are only re-sorted a logarithmic number of times
+    merged_counts = []
+    chunk_counts = []
+    num_chunk_entries = 0
+
+    num_kmers = 0
+    for reads in read_chunks:
+        if dedup:
+            read_to_multiplicity = dedup_reads(reads)
+            reads = list(read_to_multiplicity.keys())
+        kmers_per_read = np.array([max(len(read) - KMER_SIZE + 1, 0) for read in reads], dtype=np.int64)
+        high, low, kmer_indices = pack_kmers(reads, num_kmers)
+
+        # each kmer counts as many times as the read it came from
+        kmer_counts = None
+        if dedup:
+            multiplicities = np.fromiter(read_to_multiplicity.values(), dtype=np.int64, count=len(reads))
+            kmer_counts = np.repeat(multiplicities, kmers_per_read)[kmer_indices - num_kmers]
+
+        chunk_counts.append(count_packed_kmers(high, low, kmer_indices, kmer_counts))
+        num_kmers += int(kmers_per_read.sum())
+
+        num_chunk_entries += len(chunk_counts[-1][0])
+        if not merged_counts or num_chunk_entries > len(merged_counts[0][0]):
+            merged_counts = [merge_packed_kmer_counts(merged_counts + chunk_counts)]
+            chunk_counts = []
+            num_chunk_entries = 0
+
+    return merge_packed_kmer_counts(merged_counts + chunk_counts)
+
+# merges a list of packed kmer counts (from count_packed_kmers) into one
+def merge_packed_kmer_counts(all_counts):
+    if not all_counts:
+        empty_words = np.zeros(0, dtype=np.uint64)
+        empty_ints = np.zeros(0, dtype=np.int64)
+        return empty_words, empty_words, empty_ints, empty_ints
+    if len(all_counts) == 1:
+        return all_counts[0]
+
+    high, low, kmer_indices, counts = [np.concatenate(arrays) for arrays in zip(*all_counts)]
+    return count_packed_kmers(high, low, kmer_indices, counts)
+
+# applies the frequency filter to packed kmer counts (from count_packed_kmers) and unpacks the remaining kmers,
+# in the order they first appear in
+def select_frequent_packed_kmers(packed_counts, min_frequency):
+    high, low, kmer_indices, counts = packed_counts
+
+    is_frequent = counts >= min_frequency
+    high, low, kmer_indices = high[is_frequent], low[is_frequent], kmer_indices[is_frequent]
+
+    order = np.argsort(kmer_indices, kind='stable')
+    return unpack_kmers(high[order], low[order])
+
 # takes in a kmer and returns its possible starting indexes in the reference genome
-# Note: since we allow at most ERROR_THRESHOLD errors, one of the 3 parts must match perfectly to the reference genome
-def get_possible_indices(kmer, reference_index):
+# Note: since we allow at most ERROR_THRESHOLD errors, the seeds of parts - ERROR_THRESHOLD of the kmer's parts must
+# match perfectly to the reference genome (see get_seed_offsets)
+# seeds are the kmer's seeds, if they've already been found (see iter_seeds)
+def get_possible_indices(kmer, reference_index, seeds=None):
     possible_indices = []
 
-    # first divide the kmer into 1/3s
-    part_size = int(KMER_SIZE / 3)
-    first, second, third = kmer[0:part_size], kmer[part_size:(2 * part_size)], kmer[(2 * part_size):]
-
-    # check to see if the first part matches perfectly
-    if first in reference_index:
-        # add those indices as possible start indices
-        possible_indices += reference_index[first]
-
-    # check to see if the second part matches perfectly
-    if second in reference_index:
-        # subtract part_size to get the start of the kmer
-        second_matching_indices = [(index - part_size) for index in reference_index[second]]
-        # make sure all indices >= 0
-        second_matching_indices = list(filter(lambda index: index >= 0, second_matching_indices))
-        possible_indices += second_matching_indices
-
-    # check to see if the third part matches perfectly
-    if third in reference_index:
-        # subtract 2 * part_size to get the start of the kmer
-        third_matching_indices = [(index - (2 * part_size)) for index in reference_index[third]]
-        # make sure all indices >= 0
-        third_matching_indices = list(filter(lambda index: index >= 0, third_matching_indices))
-        possible_indices += third_matching_indices
+    # look up the seed of each part of the kmer, skipping any over-represented seeds (see get_capped_seed_positions)
+    # the part's start has already been subtracted from the seed's positions to get the start of the kmer
+    if seeds is None:
+        seeds = get_seeds(kmer)
+    seed_positions = get_capped_seed_positions(seeds, reference_index)
+    for _, starts in seed_positions:
+        possible_indices += starts
+
+    # with more than ERROR_THRESHOLD + 1 parts, an index has to be hit by more than one seed
+    min_hits = get_min_seed_hits(len(seed_positions))
+    if min_hits > 1:
+        hits = {}
+        for index in possible_indices:
+            hits[index] = hits.get(index, 0) + 1
+        possible_indices = [index for index, num_hits in hits.items() if num_hits >= min_hits]
 
     return possible_indices
 
 # returns the matching sections, as well as their indices in the genome for the kmer
 # Note: matching means <= ERROR_THRESHOLD mismatches
-def get_matching_sections(kmer, reference, possible_indices):
+# if packed_reference is given (from pack_reference), the mismatches are counted with packed_hamming_distance
+def get_matching_sections(kmer, reference, possible_indices, packed_reference=None):
     # list of (kmer, index) pairs in the reference genome that match the kmer we read
     matching_sections = []
 
+    packed_kmer = None if packed_reference is None else pack_sequence(kmer)
+
     for index in possible_indices:
         # get the matching section of the genome
-        matching_section = reference[index:(index + KMER_SIZE)]
+        matching_section = get_reference_section(reference, index, index + KMER_SIZE)
 
         if len(matching_section) < KMER_SIZE:
             continue
 
         # get the amount of mismatches between the kmer and the matching section
-        num_mismatches = sum(kmer[i] != matching_section[i] for i in range(KMER_SIZE))
+        if packed_kmer is not None:
+            packed_section = get_packed_section(packed_reference, index, KMER_SIZE)
+            num_mismatches = packed_hamming_distance(packed_kmer, packed_section, KMER_SIZE, ERROR_THRESHOLD)
+        else:
+            num_mismatches = sum(kmer[i] != matching_section[i] for i in range(KMER_SIZE))
 
         # if the # of mismatches <= ERROR_THRESHOLD mismatches
         # AND if # mismatches > 0 since there's no SNPs if it matches perfectly
@@ -148,13 +952,166 @@ def get_matching_sections(kmer, reference, possible_indices):
 
     return matching_sections
 
+# packs the reference genome into an array of 64-bit words, WORD_BASES bases per word (2 bits per base, first base
+# in the highest bits), for packed_hamming_distance
+# returns None if the reference has a base other than A/C/G/T, since it can't be packed (which is pointed out, since
+# the sections are then compared base by base instead)
+def pack_reference(reference):
+    codes = get_reference_codes(reference)
+    if (codes > 3).any():
+        print("Warning: the reference has bases other than A/C/G/T, so it can't be packed for the bit-parallel "
+              "comparisons, and they fall back to comparing base by base")
+        return None
+
+    # pad the reference to a whole number of words
+    num_words = -(-len(codes) // WORD_BASES)
+    padded_codes = np.zeros(num_words * WORD_BASES, dtype=np.uint64)
+    padded_codes[:len(codes)] = codes
+    padded_codes = padded_codes.reshape(num_words, WORD_BASES)
+
+    packed_reference = np.zeros(num_words, dtype=np.uint64)
+    for i in range(WORD_BASES):
+        packed_reference <<= np.uint64(2)
+        packed_reference |= padded_codes[:, i]
+
+    return packed_reference
+
+# packs a sequence into one int, 2 bits per base with the first base in the highest bits
+# returns None if the sequence has a base other than A/C/G/T
+def pack_sequence(sequence):
+    return encode_seed(sequence)
+
+# returns the packed section of the packed reference that starts at index and has length bases, as one int
+def get_packed_section(packed_reference, index, length):
+    first_word = index // WORD_BASES
+    last_word = (index + length - 1) // WORD_BASES
+
+    packed_section = 0
+    for word in packed_reference[first_word:(last_word + 1)].tolist():
+        packed_section = (packed_section << 64) | word
+
+    # drop the bases after the section, then the bases before it
+    packed_section >>= 2 * ((last_word + 1) * WORD_BASES - (index + length))
+    return packed_section & ((1 << (2 * length)) - 1)
+
+# bit-parallel Hamming distance between two packed sequences of length bases (from pack_sequence/get_packed_section)
+# XORs the sequences, folds the two bits of each base into its low bit, and popcounts one 64-bit word at a time
+# (with bin().count rather than int.bit_count, which needs Python 3.10)
+# stops as soon as there are more than max_mismatches mismatches (so the result is only exact up to
+# max_mismatches + 1)
+def packed_hamming_distance(packed_a, packed_b, length, max_mismatches):
+    difference = packed_a ^ packed_b
+
+    num_mismatches = 0
+    for shift in range(2 * (length - WORD_BASES), -2 * WORD_BASES, -2 * WORD_BASES):
+        if shift > 0:
+            word = (difference >> shift) & ((1 << 64) - 1)
+        else:
+            word = (difference << -shift) & ((1 << 64) - 1)
+
+        num_mismatches += bin((word | (word >> 1)) & LOW_BITS).count('1')
+        if num_mismatches > max_mismatches:
+            break
+
+    return num_mismatches
+
+# returns the positions (from the start of the sequences) where two packed sequences of length bases differ
+def get_packed_mismatch_positions(packed_a, packed_b, length):
+    difference = packed_a ^ packed_b
+    folded = (difference | (difference >> 1)) & int('01' * length, 2)
+
+    mismatch_positions = []
+    while folded:
+        lowest_bit = folded & -folded
+        mismatch_positions.append(length - 1 - (lowest_bit.bit_length() - 1) // 2)
+        folded ^= lowest_bit
+
+    # the lowest bits are at the end of the sequence
+    mismatch_positions.reverse()
+    return mismatch_positions
+
+# returns the reference genome as an array of bytes, so that sections of it can be compared to a kmer all at once
+# the reference can be any type from parse_ref_file: bytes and bytearrays (and memoryviews) are viewed without
+# copying them, while a str or codes are copied into a new array
+def encode_reference(reference):
+    if isinstance(reference, str):
+        reference = reference.encode('ascii')
+    elif isinstance(reference, np.ndarray):
+        return CODE_TO_ASCII[reference]
+    return np.frombuffer(reference, dtype=np.uint8)
+
+# returns the base codes (see BASE_TO_CODE) of the reference genome, or of a sequence
+# a reference parsed as codes is returned as it is, without copying it
+def get_reference_codes(reference):
+    if isinstance(reference, np.ndarray):
+        return reference
+    return BASE_TO_CODE[encode_reference(reference)]
+
+# returns the bases from start to end of the reference genome as a str, whatever type parse_ref_file returned it as
+# only the section is copied, so the stages that compare a few bases at a time work on any type of reference
+def get_reference_section(reference, start, end):
+    if isinstance(reference, str):
+        return reference[start:end]
+    if isinstance(reference, np.ndarray):
+        return CODE_TO_ASCII[reference[start:end]].tobytes().decode('ascii')
+    return bytes(reference[start:end]).decode('ascii')
+
+# the offset of each base of a kmer from the start of the kmer, used to gather sections of the encoded reference
+KMER_OFFSETS = np.arange(KMER_SIZE)
+
+# kmers with fewer candidate indices than this are checked one at a time, even when batch verifying
+BATCH_VERIFY_MIN_CANDIDATES = 3
+
+# batched version of get_matching_sections that checks every candidate index at once
+# gathers the candidate sections of encoded_reference into a (# candidates, KMER_SIZE) array and compares it to the kmer
+# returns the matching indices, along with the positions of the mismatches (within the kmer) for each of them
+def verify_candidates(kmer, encoded_reference, possible_indices):
+    if len(possible_indices) == 0:
+        return [], []
+
+    possible_indices = np.asarray(possible_indices, dtype=np.int64)
+
+    # skip sections that run off the end of the genome
+    possible_indices = possible_indices[possible_indices <= len(encoded_reference) - KMER_SIZE]
+
+    encoded_kmer = np.frombuffer(kmer.encode('ascii'), dtype=np.uint8)
+    sections = encoded_reference[possible_indices[:, None] + KMER_OFFSETS]
+    mismatches = sections != encoded_kmer
+    num_mismatches = mismatches.sum(axis=1)
+
+    # same rule as get_matching_sections: 0 < # mismatches <= ERROR_THRESHOLD
+    is_match = (num_mismatches > 0) & (num_mismatches <= ERROR_THRESHOLD)
+    if not is_match.any():
+        return [], []
+
+    matching_indices = possible_indices[is_match].tolist()
+    # the column of every mismatch in the matching rows, split up by row
+    mismatch_columns = np.nonzero(mismatches[is_match])[1].tolist()
+    row_ends = np.cumsum(num_mismatches[is_match]).tolist()
+    mismatch_positions = [mismatch_columns[(row_end - count):row_end]
+                          for row_end, count in zip(row_ends, num_mismatches[is_match].tolist())]
+
+    return matching_indices, mismatch_positions
+
 # takes in a kmer and its matching sections and returns any SNPs
-def get_snps_for_kmer(kmer, matching_sections):
+# if mismatch_positions is given (from verify_candidates), only those positions of each section are checked
+# otherwise, if packed_reference is given (from pack_reference), the mismatches are found with get_packed_mismatch_positions
+def get_snps_for_kmer(kmer, matching_sections, mismatch_positions=None, packed_reference=None):
     # maps a location to its SNP
     kmer_snps = {}
 
-    for ref_section, start_index in matching_sections:
-        for i in range(KMER_SIZE):
+    packed_kmer = None if packed_reference is None else pack_sequence(kmer)
+
+    for section_number, (ref_section, start_index) in enumerate(matching_sections):
+        if mismatch_positions is not None:
+            positions = mismatch_positions[section_number]
+        elif packed_kmer is not None:
+            packed_section = get_packed_section(packed_reference, start_index, KMER_SIZE)
+            positions = get_packed_mismatch_positions(packed_kmer, packed_section, KMER_SIZE)
+        else:
+            positions = range(KMER_SIZE)
+
+        for i in positions:
             if kmer[i] != ref_section[i]:
                 # we found a snp
                 reference_allele = ref_section[i]
@@ -167,27 +1124,39 @@ def get_snps_for_kmer(kmer, matching_sections):
     return kmer_snps
 
 # takes in kmers and a reference index and returns the SNPs
-def get_snps(kmers, reference_index, reference):
+# if packed_reference is given (from pack_reference), sections are compared with the bit-parallel kernel
+# if encoded_reference is given (from encode_reference), kmers with several candidates are checked in batches
+# with verify_candidates
+def get_snps(kmers, reference_index, reference, encoded_reference=None, packed_reference=None):
     # maps an index to the snp at that index
     snps = {}
 
-    for kmer in kmers:
+    for kmer, seeds in zip(kmers, iter_seeds(kmers)):
         # get all the possible indices that the kmer could start at
-        possible_indices = get_possible_indices(kmer, reference_index)
+        possible_indices = get_possible_indices(kmer, reference_index, seeds)
 
         # remove duplicates from possible_indices
         possible_indices = list(dict.fromkeys(possible_indices))
 
         # get matching sections in reference genome
         # each matching section is a (kmer, index) pair
-        matching_sections = get_matching_sections(kmer, reference, possible_indices)
+        # (for a couple of candidates, NumPy's per-call overhead is more than the loop in get_matching_sections)
+        # reference can be None when encoded_reference is given, in which case every kmer is batch verified
+        if encoded_reference is None or (reference is not None and
+                                         len(possible_indices) < BATCH_VERIFY_MIN_CANDIDATES):
+            matching_sections = get_matching_sections(kmer, reference, possible_indices, packed_reference)
+            mismatch_positions = None
+        else:
+            matching_indices, mismatch_positions = verify_candidates(kmer, encoded_reference, possible_indices)
+            matching_sections = [(encoded_reference[index:(index + KMER_SIZE)].tobytes().decode('ascii'), index)
+                                 for index in matching_indices]
 
         # if there's no matching sections, there won't be any SNPs
         if len(matching_sections) == 0:
             continue
 
         # find the SNPs and add them to our result
-        curr_snps = get_snps_for_kmer(kmer, matching_sections)
+        curr_snps = get_snps_for_kmer(kmer, matching_sections, mismatch_positions, packed_reference)
         
         # add the SNPs to our result (avoiding adding multiple SNPs at the same location)
         for index in curr_snps:
@@ -197,6 +1166,660 @@ def get_snps(kmers, reference_index, reference):
     # return only the SNPs
     return list(snps.values())
 
+# returns the possible start indices of a whole read, found by looking up the seed of each of its parts
+# the indices are deduplicated, in the order that they were found
+# seeds are the read's seeds, if they've already been found (see iter_seeds)
+def get_read_candidates(read, reference_index, reference_length, seeds=None):
+    last_start = reference_length - len(read)
+
+    if seeds is None:
+        seeds = get_seeds(read)
+    seed_positions = get_capped_seed_positions(seeds, reference_index)
+    candidates = {}
+    for _, starts in seed_positions:
+        # the offset has already been subtracted to get the start of the read, so make sure the read fits
+        for start in starts:
+            if start <= last_start:
+                candidates[start] = candidates.get(start, 0) + 1
+
+    # with more than ERROR_THRESHOLD + 1 parts, a candidate has to be hit by more than one seed
+    min_hits = get_min_seed_hits(len(seed_positions))
+    if min_hits > 1:
+        return [start for start, num_hits in candidates.items() if num_hits >= min_hits]
+    return list(candidates)
+
+# aligns a whole read: the read is seeded once, then checked against each candidate once
+# returns (index, # mismatches) of the best placement with <= ERROR_THRESHOLD mismatches, or None if there isn't one
+# (ties go to the first candidate found)
+# seeds are the read's seeds, if they've already been found (see iter_seeds)
+def align_read(read, reference_index, reference, packed_reference=None, seeds=None):
+    read_length = len(read)
+    packed_read = None if packed_reference is None else pack_sequence(read)
+
+    best_alignment = None
+    for index in get_read_candidates(read, reference_index, len(reference), seeds):
+        if packed_read is not None:
+            packed_section = get_packed_section(packed_reference, index, read_length)
+            num_mismatches = packed_hamming_distance(packed_read, packed_section, read_length, ERROR_THRESHOLD)
+        else:
+            section = get_reference_section(reference, index, index + read_length)
+            num_mismatches = sum(a != b for a, b in zip(read, section))
+
+        if num_mismatches <= ERROR_THRESHOLD and (best_alignment is None or num_mismatches < best_alignment[1]):
+            best_alignment = (index, num_mismatches)
+            # a perfect match can't be beaten
+            if num_mismatches == 0:
+                break
+
+    return best_alignment
+
+# aligns each read with align_read, returning a list of (read, index) pairs for the reads that aligned
+def align_reads(reads, reference_index, reference, packed_reference=None):
+    alignments = []
+    for read, seeds in zip(reads, iter_seeds(reads)):
+        alignment = align_read(read, reference_index, reference, packed_reference, seeds)
+        if alignment is not None:
+            alignments.append((read, alignment[0]))
+    return alignments
+
+# deduplicated version of align_reads: each distinct read of read_to_multiplicity (from dedup_reads) is aligned once
+# returns the (read, index) alignments, and the multiplicity of each alignment's read
+def align_weighted_reads(read_to_multiplicity, reference_index, reference, packed_reference=None):
+    alignments = align_reads(list(read_to_multiplicity.keys()), reference_index, reference, packed_reference)
+    return alignments, [read_to_multiplicity[read] for read, _ in alignments]
+
+# returns an empty pileup for a genome: pileup[i, code] is the # of aligned reads with the base CODE_TO_BASE[code] at
+# index i of the genome
+def create_pileup(genome_length):
+    return np.zeros((genome_length, 4), dtype=np.uint32)
+
+# adds the bases of the alignments (from align_reads) to the pileup, PILEUP_BATCH_SIZE alignments at a time
+# the counts are just added up, so the alignments can come in any order
+# if multiplicities is given, each alignment counts that many times (see align_weighted_reads)
+def add_to_pileup(alignments, pileup, multiplicities=None):
+    flat_pileup = pileup.reshape(-1)
+    for batch_start in range(0, len(alignments), PILEUP_BATCH_SIZE):
+        batch = alignments[batch_start:(batch_start + PILEUP_BATCH_SIZE)]
+
+        # group the reads by length so that each group can be turned into one 2D array
+        reads_by_length = {}
+        for i, (read, index) in enumerate(batch):
+            reads_by_length.setdefault(len(read), ([], [], []))
+            reads_by_length[len(read)][0].append(read)
+            reads_by_length[len(read)][1].append(index)
+            reads_by_length[len(read)][2].append(1 if multiplicities is None else
+                                                 multiplicities[batch_start + i])
+
+        for read_length, (reads, indices, weights) in reads_by_length.items():
+            codes = BASE_TO_CODE[np.frombuffer(''.join(reads).encode('ascii'), dtype=np.uint8)]
+            positions = (np.array(indices, dtype=np.int64)[:, np.newaxis] + np.arange(read_length)).reshape(-1)
+            valid = codes < 4
+
+            # each (position, base) can show up more than once, so count them before adding them
+            if multiplicities is None:
+                cells, counts = np.unique(positions[valid] * 4 + codes[valid], return_counts=True)
+            else:
+                cells, cell_numbers = np.unique(positions[valid] * 4 + codes[valid], return_inverse=True)
+                base_weights = np.repeat(np.array(weights, dtype=np.int64), read_length)[valid]
+                counts = np.bincount(cell_numbers, weights=base_weights)
+            flat_pileup[cells] += counts.astype(np.uint32)
+
+    return pileup
+
+# calls the SNPs from a pileup: at each index, the most common base other than the reference base is a SNP if
+# it's supported by at least min_support reads (like the kmer frequency filter, this removes most sequencing errors)
+# and by at least min_allele_fraction of the reads, and the index is covered by at least min_depth reads
+# the thresholds are checked for REF_BLOCK_SIZE indices at a time
+def call_pileup_snps(pileup, reference, min_support=2, min_depth=SNP_MIN_DEPTH,
+                     min_allele_fraction=SNP_MIN_ALLELE_FRACTION):
+    snps = []
+    for block_start in range(0, len(pileup), REF_BLOCK_SIZE):
+        counts = pileup[block_start:(block_start + REF_BLOCK_SIZE)].astype(np.int64)
+        depth = counts.sum(axis=1)
+
+        # don't count the reads that match the reference
+        reference_codes = get_reference_codes(reference[block_start:(block_start + len(counts))])
+        matches = reference_codes < 4
+        counts[np.flatnonzero(matches), reference_codes[matches]] = 0
+
+        variants = counts.argmax(axis=1)
+        support = counts[np.arange(len(counts)), variants]
+        # (the fraction is compared as a fraction, so that a SNP at exactly min_allele_fraction isn't lost to rounding)
+        called = ((support >= min_support) & (depth >= min_depth)
+                  & (support / np.maximum(depth, 1) >= min_allele_fraction))
+
+        for i in np.flatnonzero(called).tolist():
+            index = block_start + i
+            snps.append([get_reference_section(reference, index, index + 1), chr(CODE_TO_BASE[variants[i]]), index])
+
+    return snps
+
+# read mode version of STEPS 2-5: instead of breaking the reads into kmers, each whole read is aligned once
+# and the SNPs are called from the alignments
+# read_chunks is an iterable of lists of single reads, so the reads can be streamed
+# snp_thresholds are the keyword arguments of call_pileup_snps
+# if dedup is True, the identical reads in each chunk are collapsed and each distinct read is aligned once
+def get_snps_by_read(read_chunks, reference_index, reference, packed_reference=None, dedup=False, **snp_thresholds):
+    pileup = create_pileup(len(reference))
+    for reads in read_chunks:
+        alignments, multiplicities = align_read_chunk(reads, reference_index, reference, packed_reference, dedup)
+        add_to_pileup(alignments, pileup, multiplicities)
+    return call_pileup_snps(pileup, reference, **snp_thresholds)
+
+# aligns one chunk of reads for get_snps_by_read, returning the alignments and their multiplicities (or None)
+def align_read_chunk(reads, reference_index, reference, packed_reference=None, dedup=False):
+    if dedup:
+        return align_weighted_reads(dedup_reads(reads), reference_index, reference, packed_reference)
+    return align_reads(reads, reference_index, reference, packed_reference), None
+
+# returns the best placement of a read in either direction: (index, # mismatches, reversed), or None
+# one read of each read pair is reversed, so both the read and the reversed read are aligned
+def align_read_either_way(read, reference_index, reference, packed_reference=None):
+    forward = align_read(read, reference_index, reference, packed_reference)
+    if forward is not None and forward[1] == 0:
+        return (forward[0], forward[1], False)
+
+    backward = align_read(read[::-1], reference_index, reference, packed_reference)
+    if backward is not None and (forward is None or backward[1] < forward[1]):
+        return (backward[0], backward[1], True)
+    if forward is not None:
+        return (forward[0], forward[1], False)
+    return None
+
+# looks for a read at every start between window_start and window_end (inclusive) with a local scan: the read is
+# compared to all of the sections in the window at once, without using the seed index
+# returns (index, # mismatches) of the best placement with <= ERROR_THRESHOLD mismatches, or None
+def scan_window(read, encoded_reference, window_start, window_end):
+    read_length = len(read)
+    window_start = max(window_start, 0)
+    window_end = min(window_end, len(encoded_reference) - read_length)
+    if window_end < window_start:
+        return None
+
+    # each row of sections is the section of the reference starting at one index in the window
+    stride = encoded_reference.strides[0]
+    sections = np.lib.stride_tricks.as_strided(encoded_reference[window_start:],
+                                               shape=(window_end - window_start + 1, read_length),
+                                               strides=(stride, stride), writeable=False)
+    num_mismatches = np.count_nonzero(sections != encode_reference(read), axis=1)
+
+    best = int(num_mismatches.argmin())
+    if num_mismatches[best] > ERROR_THRESHOLD:
+        return None
+    return (window_start + best, int(num_mismatches[best]))
+
+# returns the (min offset, max offset) window that the second read of a pair is looked for in, from the offsets
+# (start of the second read - start of the first read) of the pairs used to learn the insert size
+# some of those pairs are misaligned (repeats, or structural variants between the donor and the reference), so the
+# window is the Tukey fences of the offsets: INSERT_WINDOW_IQRS interquartile ranges outside the quartiles
+def get_insert_window(insert_offsets):
+    lower_quartile, upper_quartile = np.percentile(insert_offsets, [25, 75])
+    spread = INSERT_WINDOW_IQRS * (upper_quartile - lower_quartile)
+    return (int(np.floor(lower_quartile - spread)), int(np.ceil(upper_quartile + spread)))
+
+# aligns a read pair: the first read is aligned against the whole genome in either direction, then the second read
+# (which goes in the opposite direction) is looked for with scan_window inside the insert window after the first
+# if insert_window is None (the insert size hasn't been learned yet), or the second read isn't found in the window,
+# the second read is aligned against the whole genome instead
+# returns a list of (read as it appears in the reference, index) pairs for the reads that aligned, and the offset
+# between the reads if both of them were aligned against the whole genome (or None)
+def align_read_pair(read_pair, reference_index, reference, encoded_reference, insert_window, packed_reference=None):
+    first_read, second_read = read_pair
+    alignments = []
+
+    first_alignment = align_read_either_way(first_read, reference_index, reference, packed_reference)
+    if first_alignment is None:
+        second_alignment = align_read_either_way(second_read, reference_index, reference, packed_reference)
+        if second_alignment is not None:
+            alignments.append((second_read[::-1] if second_alignment[2] else second_read, second_alignment[0]))
+        return alignments, None
+
+    first_index, _, first_reversed = first_alignment
+    alignments.append((first_read[::-1] if first_reversed else first_read, first_index))
+    if not first_reversed:
+        second_read = second_read[::-1]
+
+    if insert_window is not None:
+        second_alignment = scan_window(second_read, encoded_reference,
+                                       first_index + insert_window[0], first_index + insert_window[1])
+        if second_alignment is not None:
+            alignments.append((second_read, second_alignment[0]))
+            return alignments, None
+
+    second_alignment = align_read(second_read, reference_index, reference, packed_reference)
+    if second_alignment is None:
+        return alignments, None
+    alignments.append((second_read, second_alignment[0]))
+
+    # only learn the insert size from pairs where both reads were aligned against the whole genome
+    offset = second_alignment[0] - first_index if insert_window is None else None
+    return alignments, offset
+
+# paired version of STEPS 2-5: each read pair is aligned with align_read_pair and the SNPs are called from the
+# alignments
+# the insert window is learned from the first INSERT_TRAINING_PAIRS pairs where both reads aligned, after which
+# the second read of each pair is only looked for inside the window
+# read_pair_chunks is an iterable of lists of read pairs, so the reads can be streamed, and the rest of the
+# arguments are the same as get_snps_by_read (with dedup collapsing identical read pairs)
+def get_snps_by_pair(read_pair_chunks, reference_index, reference, packed_reference=None, dedup=False,
+                     **snp_thresholds):
+    encoded_reference = encode_reference(reference)
+    pileup = create_pileup(len(reference))
+    insert_state = {'offsets': [], 'window': None}
+
+    for read_pairs in read_pair_chunks:
+        alignments, multiplicities = align_read_pair_chunk(read_pairs, reference_index, reference, encoded_reference,
+                                                           insert_state, packed_reference, dedup)
+        add_to_pileup(alignments, pileup, multiplicities)
+
+    return call_pileup_snps(pileup, reference, **snp_thresholds)
+
+# aligns one chunk of read pairs for get_snps_by_pair, returning the alignments and their multiplicities (or None)
+# insert_state holds the insert offsets learned so far and the insert window (None until it's learned), and is
+# updated as the pairs are aligned
+def align_read_pair_chunk(read_pairs, reference_index, reference, encoded_reference, insert_state,
+                          packed_reference=None, dedup=False):
+    if dedup:
+        pair_to_multiplicity = dedup_reads([tuple(read_pair) for read_pair in read_pairs])
+        read_pairs = list(pair_to_multiplicity.keys())
+
+    chunk_alignments = []
+    chunk_multiplicities = [] if dedup else None
+    for read_pair in read_pairs:
+        alignments, offset = align_read_pair(read_pair, reference_index, reference, encoded_reference,
+                                             insert_state['window'], packed_reference)
+        chunk_alignments += alignments
+
+        # a duplicated pair counts as many times as it appears in the pileup
+        if dedup:
+            chunk_multiplicities += [pair_to_multiplicity[read_pair]] * len(alignments)
+
+        if offset is not None:
+            insert_state['offsets'].append(offset)
+            if len(insert_state['offsets']) == INSERT_TRAINING_PAIRS:
+                insert_state['window'] = get_insert_window(insert_state['offsets'])
+                print("Insert window: ", insert_state['window'])
+
+    return chunk_alignments, chunk_multiplicities
+
+# copies an array into a new block of shared memory
+# returns the block, and a (name, shape, dtype) description that other processes can attach to it with
+def create_shared_array(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared_array[:] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+# copies the encoded reference and the array index into shared memory for the worker processes
+# returns the blocks (to be freed with free_shared_arrays) and the descriptions that the workers attach to them with
+def share_snp_arrays(encoded_reference, reference_index):
+    blocks = []
+    descriptions = []
+    for array in (encoded_reference,) + tuple(reference_index):
+        block, description = create_shared_array(array)
+        blocks.append(block)
+        descriptions.append(description)
+    return blocks, descriptions
+
+# frees blocks of shared memory made by create_shared_array
+def free_shared_arrays(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+# attaches to an array created by create_shared_array without copying it
+# the block has to be kept around for as long as the array is used
+def attach_shared_array(description):
+    name, shape, dtype = description
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+# the shared memory blocks, encoded reference and array index that each worker process attaches to
+snp_worker_state = {}
+
+# the counters that each worker process keeps, which are sent back to the main process and added up there
+WORKER_COUNTERS = ((seed_cap_state, SEED_CAP_COUNTS), (seed_cache_state, SEED_CACHE_COUNTS),
+                   (dedup_state, DEDUP_COUNTS))
+
+# sets the counters of a worker process back to 0 before it starts on a new task
+def reset_worker_counts():
+    for state, keys in WORKER_COUNTERS:
+        for key in keys:
+            state[key] = 0
+
+# returns the counters of a worker process, to be passed to add_worker_counts in the main process
+def get_worker_counts():
+    return [[state[key] for key in keys] for state, keys in WORKER_COUNTERS]
+
+# adds the counters from a worker process (from get_worker_counts) to the main process's counters
+def add_worker_counts(worker_counts):
+    for (state, keys), counts in zip(WORKER_COUNTERS, worker_counts):
+        for key, count in zip(keys, counts):
+            state[key] += count
+
+# runs once in each worker process of create_snp_pool
+# with packed_verify, the worker packs the reference (see pack_reference) from a view of the shared memory, and
+# get_snps_for_shard uses it like get_snps with both encoded_reference and packed_reference
+def init_snp_worker(descriptions, seed_cap, seed_cache_size, seed_pattern, num_parts, minimizer_window,
+                    packed_verify=False):
+    blocks, arrays = zip(*[attach_shared_array(description) for description in descriptions])
+    seed_cap_state['cap'] = seed_cap
+    seed_cache_state['size'] = seed_cache_size
+    set_seed_layout(seed_pattern, num_parts, minimizer_window)
+    snp_worker_state['blocks'] = blocks
+    snp_worker_state['encoded_reference'] = arrays[0]
+    snp_worker_state['reference_index'] = tuple(arrays[1:])
+    snp_worker_state['reference'] = arrays[0].data if packed_verify else None
+    snp_worker_state['packed_reference'] = pack_reference(arrays[0].data) if packed_verify else None
+
+# finds the SNPs for one shard of the kmers inside a worker process
+# also returns the worker's counts for the shard, like how many seeds and candidate indices the seed cap pruned
+# (the seed hit cache itself is kept for the worker's next shard)
+def get_snps_for_shard(kmers):
+    reset_worker_counts()
+    snps = get_snps(kmers, snp_worker_state['reference_index'], snp_worker_state['reference'],
+                    snp_worker_state['encoded_reference'], snp_worker_state['packed_reference'])
+    return snps, get_worker_counts()
+
+# starts num_workers worker processes for get_snps_in_pool, which attach to the shared arrays from share_snp_arrays
+# (and each pack the reference, with packed_verify)
+def create_snp_pool(descriptions, num_workers, packed_verify=False):
+    return multiprocessing.Pool(num_workers, initializer=init_snp_worker,
+                                initargs=(descriptions, seed_cap_state['cap'], seed_cache_state['size'],
+                                          seed_layout['pattern'], seed_layout['parts'], seed_layout['window'],
+                                          packed_verify))
+
+# splits a list of kmers or reads into shards for num_workers worker processes
+# a few shards are used per worker so that a slow shard doesn't hold up the whole pool
+def split_into_shards(items, num_workers):
+    shard_size = max(1, -(-len(items) // (num_workers * 4)))
+    return [items[i:(i + shard_size)] for i in range(0, len(items), shard_size)]
+
+# splits the kmers into shards and finds their SNPs in a pool from create_snp_pool (with num_workers processes)
+def get_snps_in_pool(pool, kmers, num_workers):
+    shard_results = pool.map(get_snps_for_shard, split_into_shards(kmers, num_workers))
+
+    # merge the shards in order, keeping the first SNP seen at each location (same as get_snps)
+    snps = {}
+    for curr_snps, worker_counts in shard_results:
+        add_worker_counts(worker_counts)
+        for snp in curr_snps:
+            if snp[2] not in snps:
+                snps[snp[2]] = snp
+
+    return list(snps.values())
+
+# parallel version of get_snps that finds the SNPs of the kmers in num_workers processes
+# the encoded reference and the array index are put in shared memory, so the workers don't each get a copy
+# with packed_verify, the workers also use the bit-parallel kernel (see init_snp_worker)
+def get_snps_parallel(kmers, reference_index, encoded_reference, num_workers, packed_verify=False):
+    blocks, descriptions = share_snp_arrays(encoded_reference, reference_index)
+    try:
+        with create_snp_pool(descriptions, num_workers, packed_verify) as pool:
+            return get_snps_in_pool(pool, kmers, num_workers)
+    finally:
+        free_shared_arrays(blocks)
+
+# runs once in each worker process of get_snps_pipelined
+def init_pipeline_worker(descriptions, seed_cap, seed_cache_size, seed_pattern, num_parts, minimizer_window,
+                         packed_verify):
+    init_snp_worker(descriptions, seed_cap, seed_cache_size, seed_pattern, num_parts, minimizer_window,
+                    packed_verify)
+    # the reference is a view of the shared memory (see get_reference_section), so the worker doesn't copy it
+    snp_worker_state['reference'] = snp_worker_state['encoded_reference'].data
+
+# aligns one chunk of reads (or read pairs, if insert_window is given) inside a worker process of get_snps_pipelined
+# returns the alignments, their multiplicities (or None) and the worker's counts for the chunk
+def align_chunk_in_worker(chunk, insert_window, dedup):
+    reset_worker_counts()
+    if insert_window is None:
+        alignments, multiplicities = align_read_chunk(chunk, snp_worker_state['reference_index'],
+                                                      snp_worker_state['reference'],
+                                                      snp_worker_state['packed_reference'], dedup)
+    else:
+        insert_state = {'offsets': [], 'window': insert_window}
+        alignments, multiplicities = align_read_pair_chunk(chunk, snp_worker_state['reference_index'],
+                                                           snp_worker_state['reference'],
+                                                           snp_worker_state['encoded_reference'], insert_state,
+                                                           snp_worker_state['packed_reference'], dedup)
+    return alignments, multiplicities, get_worker_counts()
+
+# pipelined version of get_snps_by_read and get_snps_by_pair (if paired is True), where the stages overlap instead of
+# running one after the other: a reader thread parses the next chunks of the reads file (see prefetch_chunks),
+# num_workers processes align the chunks, and the main process adds each aligned chunk to the pileup, so the disk,
+# the workers and the pileup are all kept busy at once
+# if prefetch is False, the chunks are taken from read_chunks as they're needed, without the reader thread (this is
+# how --workers aligns the reads in parallel without --pipeline)
+# at most PIPELINE_TASKS_PER_WORKER chunks per worker are waiting to be aligned at a time, and the reader is held
+# back when they're full, so memory is capped no matter how big the reads file is
+# the encoded reference and the array index are put in shared memory, like in get_snps_parallel
+# in paired mode, the chunks are aligned in the main process until the insert window has been learned, since each
+# pair depends on the ones before it until then
+# the rest of the arguments are the same as get_snps_by_read, and the SNPs are the same as without the pipeline
+def get_snps_pipelined(read_chunks, paired, reference_index, reference, num_workers, packed_reference=None,
+                       dedup=False, prefetch=True, **snp_thresholds):
+    encoded_reference = encode_reference(reference)
+    pileup = create_pileup(len(reference))
+    insert_state = {'offsets': [], 'window': None}
+    blocks, descriptions = share_snp_arrays(encoded_reference, reference_index)
+    if prefetch:
+        read_chunks = prefetch_chunks(read_chunks)
+
+    # the calling stage: adds the oldest aligned chunk to the pileup
+    def add_oldest_result():
+        alignments, multiplicities, worker_counts = pending_results.popleft().get()
+        add_worker_counts(worker_counts)
+        add_to_pileup(alignments, pileup, multiplicities)
+
+    try:
+        with multiprocessing.Pool(num_workers, initializer=init_pipeline_worker,
+                                  initargs=(descriptions, seed_cap_state['cap'], seed_cache_state['size'],
+                                            seed_layout['pattern'], seed_layout['parts'], seed_layout['window'],
+                                            packed_reference is not None)) as pool:
+            pending_results = deque()
+            for chunk in read_chunks:
+                if paired and insert_state['window'] is None:
+                    alignments, multiplicities = align_read_pair_chunk(chunk, reference_index, reference,
+                                                                       encoded_reference, insert_state,
+                                                                       packed_reference, dedup)
+                    add_to_pileup(alignments, pileup, multiplicities)
+                    continue
+
+                pending_results.append(pool.apply_async(align_chunk_in_worker,
+                                                        (chunk, insert_state['window'], dedup)))
+                if len(pending_results) >= num_workers * PIPELINE_TASKS_PER_WORKER:
+                    add_oldest_result()
+
+            while pending_results:
+                add_oldest_result()
+    finally:
+        free_shared_arrays(blocks)
+
+    return call_pileup_snps(pileup, reference, **snp_thresholds)
+
+# packs a list of strings into one array of bytes and an array of their lengths, so they can be checkpointed
+def pack_strings(strings):
+    data = np.frombuffer(''.join(strings).encode('ascii'), dtype=np.uint8)
+    return data, np.array([len(string) for string in strings], dtype=np.int64)
+
+# turns the arrays from pack_strings back into a list of strings
+def unpack_strings(data, lengths):
+    all_strings = data.tobytes().decode('ascii')
+    ends = np.cumsum(lengths).tolist()
+    return [all_strings[(end - length):end] for end, length in zip(ends, lengths.tolist())]
+
+# returns the absolute path, size and modification time of the reads file, which each checkpoint is saved with so
+# that --resume can tell whether the reads file is the same one (even when it's given by a different relative path)
+def get_reads_file_stamp(reads_fn):
+    stat = os.stat(reads_fn)
+    return {'reads_file': os.path.abspath(reads_fn), 'reads_size': stat.st_size, 'reads_mtime': stat.st_mtime_ns}
+
+# returns the rest of what each checkpoint is saved with, which the results so far depend on besides the reads: the
+# reference genome (hashed as in get_cached_index), the seed layout (see set_seed_layout) and seed cap, and the SNP
+# thresholds (see call_pileup_snps), with no minimizer window or seed cap saved as 0
+def get_run_stamp(reference, min_depth, min_allele_fraction):
+    return {'reference_hash': get_reference_hash(reference), 'seed_pattern': seed_layout['pattern'],
+            'seed_parts': seed_layout['parts'], 'minimizer_window': seed_layout['window'] or 0,
+            'seed_cap': seed_cap_state['cap'] or 0, 'min_depth': min_depth, 'min_allele_fraction': min_allele_fraction}
+
+# returns whether a checkpoint (from read_checkpoint_file) was saved in mode for the reads file reads_fn, and the
+# reads file hasn't changed since, with the same run_stamp (from get_run_stamp)
+def is_checkpoint_for(checkpoint, mode, reads_fn, run_stamp):
+    try:
+        stamp = get_reads_file_stamp(reads_fn)
+    except OSError:
+        return False
+    stamp.update(run_stamp)
+    return str(checkpoint['mode']) == mode and all(name in checkpoint and checkpoint[name].item() == value
+                                                   for name, value in stamp.items())
+
+# writes the state of a run to checkpoint_fn as a compressed .npz file of arrays, so that --resume can pick up from it
+# (with the stamps of the reads file and of run_stamp, from get_run_stamp)
+# like save_index_file, the checkpoint is written to a temporary file first, so that a run that dies while writing
+# it still leaves the previous checkpoint behind
+def save_checkpoint(checkpoint_fn, mode, reads_fn, run_stamp, **state):
+    tmp_fn = checkpoint_fn + '.tmp'
+    with open(tmp_fn, 'wb') as checkpoint_file:
+        np.savez_compressed(checkpoint_file, mode=mode, **get_reads_file_stamp(reads_fn), **run_stamp, **state)
+    os.replace(tmp_fn, checkpoint_fn)
+    print("Checkpoint saved")
+
+# reads a file written by save_checkpoint into a dictionary of arrays, or returns None if it can't be read
+def read_checkpoint_file(checkpoint_fn):
+    try:
+        with np.load(checkpoint_fn) as checkpoint_file:
+            return {name: checkpoint_file[name] for name in checkpoint_file.files}
+    except IOError:
+        print("Could not read file: ", checkpoint_fn)
+        return None
+
+# loads a checkpoint written by save_checkpoint, or returns None if there isn't one
+def load_checkpoint(checkpoint_fn):
+    if not os.path.exists(checkpoint_fn):
+        print("No checkpoint to resume from, starting from the beginning")
+        return None
+
+    checkpoint = read_checkpoint_file(checkpoint_fn)
+    if checkpoint is not None:
+        print("Resuming from checkpoint")
+    return checkpoint
+
+# the file that the kmers of a kmer mode checkpoint are saved in, next to the checkpoint
+# the kmers don't change during a run, so they're written once instead of with every checkpoint
+def get_kmer_checkpoint_fn(checkpoint_fn):
+    return checkpoint_fn + '.kmers'
+
+# checkpointed version of STEP 5 in kmer mode: the kmers are handed to get_snps (or to a pool from create_snp_pool,
+# with more than one worker) CHECKPOINT_BATCH_SIZE at a time, and how many of them are done and the SNPs found so far
+# are checkpointed at most once every checkpoint_interval seconds
+# if checkpoint is given (from load_checkpoint), the SNPs and the # of kmers done are picked up from it, otherwise the
+# kmers are saved once (see get_kmer_checkpoint_fn) before any of them are aligned
+def get_snps_checkpointed(kmers, reference_index, reference, checkpoint_fn, checkpoint_interval, reads_fn,
+                          run_stamp, checkpoint=None, encoded_reference=None, packed_reference=None, num_workers=1):
+    snps = {}
+    num_kmers_done = 0
+
+    def write_checkpoint():
+        snp_bases = np.array([[ord(snp[0]), ord(snp[1])] for snp in snps.values()], dtype=np.uint8).reshape(-1, 2)
+        save_checkpoint(checkpoint_fn, 'kmer', reads_fn, run_stamp, num_kmers_done=num_kmers_done,
+                        snp_indices=np.array(list(snps.keys()), dtype=np.int64), snp_bases=snp_bases)
+
+    if checkpoint is not None:
+        num_kmers_done = int(checkpoint['num_kmers_done'])
+        for index, (ref_base, alt_base) in zip(checkpoint['snp_indices'].tolist(), checkpoint['snp_bases'].tolist()):
+            snps[index] = [chr(ref_base), chr(alt_base), index]
+    else:
+        kmer_data, kmer_lengths = pack_strings(kmers)
+        save_checkpoint(get_kmer_checkpoint_fn(checkpoint_fn), 'kmer', reads_fn, run_stamp, kmers=kmer_data,
+                        kmer_lengths=kmer_lengths)
+        write_checkpoint()
+
+    # with more than one worker, the shared memory and the pool are set up once and used for every batch
+    blocks = []
+    pool = None
+    try:
+        if num_workers > 1:
+            blocks, descriptions = share_snp_arrays(encoded_reference, reference_index)
+            pool = create_snp_pool(descriptions, num_workers, packed_reference is not None)
+
+        # the SNPs of each batch are added in order, keeping the first SNP seen at each location (same as get_snps)
+        last_checkpoint_time = time.time()
+        for batch_start in range(num_kmers_done, len(kmers), CHECKPOINT_BATCH_SIZE):
+            batch = kmers[batch_start:(batch_start + CHECKPOINT_BATCH_SIZE)]
+            if pool is not None:
+                batch_snps = get_snps_in_pool(pool, batch, num_workers)
+            else:
+                batch_snps = get_snps(batch, reference_index, reference, encoded_reference, packed_reference)
+            for snp in batch_snps:
+                if snp[2] not in snps:
+                    snps[snp[2]] = snp
+
+            num_kmers_done = batch_start + len(batch)
+            if time.time() - last_checkpoint_time >= checkpoint_interval:
+                write_checkpoint()
+                last_checkpoint_time = time.time()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        free_shared_arrays(blocks)
+
+    write_checkpoint()
+    return list(snps.values())
+
+# skips the first num_items items (reads or read pairs) of an iterable of chunks
+def skip_chunk_items(chunks, num_items):
+    for chunk in chunks:
+        if num_items >= len(chunk):
+            num_items -= len(chunk)
+            continue
+        yield chunk[num_items:]
+        num_items = 0
+
+# checkpointed version of get_snps_by_read and get_snps_by_pair (if paired is True): after each chunk, the # of reads
+# (or read pairs) done, the pileup and the insert window are checkpointed, at most once every checkpoint_interval
+# seconds
+# if checkpoint is given (from load_checkpoint), all of those are picked up from it, and the reads that were already
+# done are skipped (they're still parsed, but not aligned again)
+# the rest of the arguments are the same as get_snps_by_read
+def get_snps_by_chunk_checkpointed(read_chunks, paired, reference_index, reference, checkpoint_fn,
+                                   checkpoint_interval, reads_fn, run_stamp, checkpoint=None, packed_reference=None,
+                                   dedup=False, **snp_thresholds):
+    encoded_reference = encode_reference(reference)
+    pileup = create_pileup(len(reference))
+    insert_state = {'offsets': [], 'window': None}
+    num_reads_done = 0
+    mode = 'paired' if paired else 'read'
+
+    def write_checkpoint():
+        save_checkpoint(checkpoint_fn, mode, reads_fn, run_stamp, num_reads_done=num_reads_done, pileup=pileup,
+                        insert_offsets=np.array(insert_state['offsets'], dtype=np.int64),
+                        insert_window=np.array(insert_state['window'] or [], dtype=np.int64))
+
+    if checkpoint is not None:
+        num_reads_done = int(checkpoint['num_reads_done'])
+        pileup = checkpoint['pileup']
+        insert_state['offsets'] = checkpoint['insert_offsets'].tolist()
+        if len(checkpoint['insert_window']) > 0:
+            insert_state['window'] = tuple(checkpoint['insert_window'].tolist())
+        read_chunks = skip_chunk_items(read_chunks, num_reads_done)
+
+    last_checkpoint_time = time.time()
+    for chunk in read_chunks:
+        if paired:
+            alignments, multiplicities = align_read_pair_chunk(chunk, reference_index, reference, encoded_reference,
+                                                               insert_state, packed_reference, dedup)
+        else:
+            alignments, multiplicities = align_read_chunk(chunk, reference_index, reference, packed_reference, dedup)
+        add_to_pileup(alignments, pileup, multiplicities)
+
+        num_reads_done += len(chunk)
+        if time.time() - last_checkpoint_time >= checkpoint_interval:
+            write_checkpoint()
+            last_checkpoint_time = time.time()
+
+    write_checkpoint()
+    return call_pileup_snps(pileup, reference, **snp_thresholds)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='basic_aligner.py takes in data for homework assignment 1 consisting '
                                      'of a genome and a set of reads and aligns the reads to the reference genome, '
@@ -212,14 +1835,140 @@ if __name__ == "__main__":
                              'online submission system recognizes which leaderboard this file should be submitted to.'
                              'This HAS to be practice_W_1_chr_1 for the practice data and hw1_W_2_chr_1 for the '
                              'for-credit assignment!')
+    parser.add_argument('--index', choices=['dict', 'array'], default='dict', dest='index_type',
+                        help='Reference index backend: a dict of lists (default) or sorted NumPy arrays, which '
+                             'uses about 10x less memory per reference base.')
+    parser.add_argument('--indexDir', dest='index_dir', default=None,
+                        help='Directory to save the array index in. Later runs against the same reference and '
+                             'KMER_SIZE memory-map the saved index instead of rebuilding it (implies --index array).')
+    parser.add_argument('--batchVerify', action='store_true', dest='batch_verify',
+                        help='Check all of the candidate indices of a kmer at once with NumPy, instead of one '
+                             'base at a time.')
+    parser.add_argument('--workers', type=int, default=1, dest='workers',
+                        help='Number of worker processes to find SNPs with (each gets a share of the kmers in kmer '
+                             'mode, or of the reads in read and paired mode). With more than 1, the reference and '
+                             'the array index are shared between the workers (implies --index array).')
+    parser.add_argument('--chunkSize', type=int, default=None, dest='chunk_size',
+                        help='Stream the reads file in chunks of this many read pairs instead of loading all of it '
+                             'into memory, counting the kmers of each chunk as it is read.')
+    parser.add_argument('--packedKmers', action='store_true', dest='packed_kmers',
+                        help='Count the kmers as 2-bit packed integers with a NumPy sort, and only turn the kmers '
+                             'that pass the frequency filter into strings.')
+    parser.add_argument('--seedCap', type=int, default=None, dest='seed_cap',
+                        help='Skip seeds with more than this many positions in the reference (like the seeds of '
+                             'tandem repeats) when another seed of the kmer or read is under the cap, otherwise '
+                             'down-sample the least frequent seed to this many positions.')
+    parser.add_argument('--seedCache', type=int, default=None, dest='seed_cache',
+                        help='Keep the candidate starts of up to this many (seed, offset) pairs in an LRU cache, so '
+                             'that seeds shared by overlapping kmers or reads are only looked up once.')
+    parser.add_argument('--seedParts', type=int, default=ERROR_THRESHOLD + 1, dest='seed_parts',
+                        help='Number of parts to split each kmer or read into, with one seed per part. More than '
+                             'ERROR_THRESHOLD + 1 parts gives shorter seeds, but each candidate then has to be hit '
+                             'by parts - ERROR_THRESHOLD seeds.')
+    parser.add_argument('--seedSize', default=None, dest='seed_size',
+                        help='Seed size, or "auto" to pick the smallest seed that is selective enough for the '
+                             'length of the reference. Defaults to the size of each part of a kmer.')
+    parser.add_argument('--seedPattern', default=None, dest='seed_pattern',
+                        help='Spaced seed pattern, with a 1 for each base that is part of the seed and a 0 for each '
+                             'base that is skipped (e.g. 1101101101101101). Overrides --seedSize.')
+    parser.add_argument('--minimizerWindow', type=int, default=None, dest='minimizer_window',
+                        help='Only index the seeds that are the minimizer of some window of this many consecutive '
+                             'seeds of the reference (about 2 / (window + 1) of them), and seed each kmer or read with '
+                             'its own minimizers. Shrinks the index by about a factor of window / 2.')
+    parser.add_argument('--mode', choices=['kmer', 'read', 'paired'], default='kmer', dest='mode',
+                        help='Alignment mode: break the reads into kmers and align each kmer (default), align '
+                             'each whole read once with pigeonhole seeds and call the SNPs from the alignments '
+                             '(read), or do the same for read pairs, looking for the second read of each pair only '
+                             'inside the insert window learned from the first pairs (paired).')
+    parser.add_argument('--minDepth', type=int, default=SNP_MIN_DEPTH, dest='min_depth',
+                        help='In read and paired mode, only call SNPs at positions covered by at least this many '
+                             'aligned reads (default SNP_MIN_DEPTH, which is 0).')
+    parser.add_argument('--minAlleleFraction', type=float, default=SNP_MIN_ALLELE_FRACTION,
+                        dest='min_allele_fraction',
+                        help='In read and paired mode, only call SNPs supported by at least this fraction of the '
+                             'aligned reads at the position (default SNP_MIN_ALLELE_FRACTION, which is 0.3). '
+                             '0 turns the filter off.')
+    parser.add_argument('--pipeline', action='store_true', dest='pipeline',
+                        help='Overlap the stages instead of running them one after the other: the reads file is read '
+                             'in chunks by a separate thread while the previous chunks are processed, and in read and '
+                             'paired mode the chunks are aligned by --workers processes while the main process adds '
+                             'the aligned chunks to the pileup (implies --index array in those modes).')
+    parser.add_argument('--dedup', action='store_true', dest='dedup',
+                        help='Collapse identical reads (or read pairs in paired mode) into one read with a '
+                             'multiplicity, so that each distinct read is only broken into kmers or aligned once.')
+    parser.add_argument('--checkpoint', default=None, dest='checkpoint',
+                        help='Periodically save the state of the run to this file (the reads done so far and the '
+                             'pileup in read and paired mode, or the SNPs found so far in kmer mode, where the '
+                             'frequent kmers are saved once to the same name plus ".kmers"), so that it can be picked '
+                             'up again with --resume. The index is cached in the same directory unless --indexDir is '
+                             'given.')
+    parser.add_argument('--checkpointInterval', type=float, default=60, dest='checkpoint_interval',
+                        help='With --checkpoint, the minimum # of seconds between checkpoints (default 60).')
+    parser.add_argument('--resume', action='store_true', dest='resume',
+                        help='Pick up from the last checkpoint in the --checkpoint file, if there is one.')
+    parser.add_argument('--packedVerify', action='store_true', dest='packed_verify',
+                        help='Compare kmers to the reference with a bit-parallel Hamming distance on 2-bit packed '
+                             'words, stopping as soon as there are more than ERROR_THRESHOLD mismatches.')
     args = parser.parse_args()
+    if args.seed_cap is not None and args.seed_cap < 1:
+        parser.error('--seedCap must be at least 1')
+    seed_cap_state['cap'] = args.seed_cap
+    if args.seed_cache is not None and args.seed_cache < 1:
+        parser.error('--seedCache must be at least 1')
+    seed_cache_state['size'] = args.seed_cache
+    if args.seed_parts <= ERROR_THRESHOLD:
+        parser.error('--seedParts must be more than ERROR_THRESHOLD')
+    if args.seed_pattern is not None and (args.seed_pattern.strip('01') or not args.seed_pattern.startswith('1')
+                                          or not args.seed_pattern.endswith('1')
+                                          or args.seed_pattern.count('1') > 32):
+        parser.error('--seedPattern must be 0s and 1s, start and end with a 1, and have at most 32 1s')
+    if args.minimizer_window is not None and args.minimizer_window < 1:
+        parser.error('--minimizerWindow must be at least 1')
+    if args.seed_size is not None and args.seed_size != 'auto' and \
+            not (args.seed_size.isdigit() and 1 <= int(args.seed_size) <= 32):
+        parser.error('--seedSize must be "auto" or a number from 1 to 32')
+    if args.seed_parts > KMER_SIZE and args.seed_pattern is None and args.seed_size is None:
+        parser.error('--seedParts can\'t be more than the kmer size (' + str(KMER_SIZE) + ') without --seedSize')
+    # every part of a kmer has to have room for its seed (see get_seed_offsets), otherwise some kmers with
+    # <= ERROR_THRESHOLD mismatches would be missed; "auto" is capped at the part size, so it always fits
+    if args.mode == 'kmer' and args.minimizer_window is None:
+        if args.seed_pattern is not None:
+            seed_span = len(args.seed_pattern)
+        elif args.seed_size is not None and args.seed_size != 'auto':
+            seed_span = int(args.seed_size)
+        else:
+            seed_span = KMER_SIZE // args.seed_parts
+        if seed_span * args.seed_parts > KMER_SIZE:
+            parser.error('--seedSize (or the length of --seedPattern) times --seedParts must be at most the kmer '
+                         'size (' + str(KMER_SIZE) + ')')
+    if args.pipeline and args.chunk_size is None:
+        args.chunk_size = PIPELINE_CHUNK_SIZE
+    if args.resume and args.checkpoint is None:
+        parser.error('--resume needs --checkpoint')
+    if args.checkpoint is not None:
+        if args.pipeline:
+            parser.error('--checkpoint can\'t be used with --pipeline')
+        if args.index_dir is None:
+            args.index_dir = os.path.dirname(os.path.abspath(args.checkpoint))
+        if args.mode != 'kmer' and args.chunk_size is None:
+            args.chunk_size = CHECKPOINT_CHUNK_SIZE
+        if args.mode != 'kmer' and args.workers > 1:
+            parser.error('--checkpoint can only be used with --workers in kmer mode')
     reference_fn = args.reference_file
     reads_fn = args.reads_file
 
-    input_reads = parse_reads_file(reads_fn)
-    if input_reads is None:
-        sys.exit(1)
-    reference = parse_ref_file(reference_fn)
+    # with --resume, pick up from the last checkpoint (which is checked against this run once the seeds are chosen in
+    # STEP 1)
+    checkpoint = load_checkpoint(args.checkpoint) if args.resume else None
+
+    # when streaming, the reads are parsed chunk by chunk in STEPS 2-4 instead
+    # when resuming in kmer mode, the kmers come from the checkpoint, so the reads aren't parsed at all
+    if args.chunk_size is None and not (args.mode == 'kmer' and checkpoint is not None):
+        input_reads = parse_reads_file(reads_fn)
+        if input_reads is None:
+            sys.exit(1)
+    # the reference is kept as a bytearray, which every stage can slice without copying the whole genome
+    reference = parse_ref_file(reference_fn, 'bytearray')
     if reference is None:
         sys.exit(1)
 
@@ -228,36 +1977,195 @@ if __name__ == "__main__":
     """
 
     ###### STEP 1: CREATE AN INDEX FOR THE GENOME ######
-    # reference_index maps each 1/3 of a kmer in the reference genome to its index
-    reference_index = index_genome(reference)
+    # first, choose the seeds that the kmers or reads are split into
+    if args.seed_pattern is not None:
+        seed_pattern = args.seed_pattern
+    elif args.seed_size == 'auto':
+        seed_pattern = '1' * choose_seed_size(len(reference), KMER_SIZE // args.seed_parts)
+    elif args.seed_size is not None:
+        seed_pattern = '1' * int(args.seed_size)
+    else:
+        seed_pattern = '1' * (KMER_SIZE // args.seed_parts)
+    set_seed_layout(seed_pattern, args.seed_parts, args.minimizer_window)
 
-    ###### STEP 2: CONVERT FROM READ-PAIRS TO SINGLE READS ######
-    # in order to avoid issues with variable length read pairs, we will
-    # consider each part of the read pair as its own independent read
-    # therefore, we "flatten" the input_reads list so each read is its own entry
-    input_reads = [read for read_pair in input_reads for read in read_pair]
+    # the checkpoint has to be from the same mode, the same reads file (unchanged since the checkpoint was saved) and
+    # the same reference, seeds and SNP thresholds
+    run_stamp = get_run_stamp(reference, args.min_depth, args.min_allele_fraction) if args.checkpoint else None
+    if checkpoint is not None and not is_checkpoint_for(checkpoint, args.mode, reads_fn, run_stamp):
+        print("Checkpoint is from a different mode, reads file, reference or settings: ", args.checkpoint)
+        sys.exit(1)
 
-    ###### STEP 3: BREAK DOWN READS INTO SMALLER K-MERS ######
-    # currently, our reads are 50-mers
-    # we will use k = KMER_SIZE to break them down into KMER_SIZE-mers
-    kmers = break_into_kmers(input_reads)
+    # reference_index maps each seed in the reference genome to its index
+    if args.index_dir is not None:
+        reference_index = get_cached_index(reference, args.index_dir)
+    elif args.index_type == 'array' or args.workers > 1 or (args.pipeline and args.mode != 'kmer'):
+        reference_index = index_genome_array(reference)
+    else:
+        reference_index = index_genome(reference)
 
-    ###### STEP 4: REMOVE INFREQUENT KMERS ######
-    # any kmer with low frequency has a high probability of being erroneous
+    if args.minimizer_window is not None:
+        if isinstance(reference_index, dict):
+            num_positions = sum(len(positions) for positions in reference_index.values())
+        else:
+            num_positions = len(reference_index[2])
+        print("Minimizer index: ", num_positions, " positions for ", len(reference), " bases")
 
-    # first, map each kmer to the amount of times it occurs
-    kmer_to_frequency = get_kmer_frequencies(kmers)
+    if args.mode == 'read':
+        ###### STEPS 2-5: ALIGN EACH WHOLE READ ONCE AND FIND THE SNPS FROM THE ALIGNMENTS ######
+        # each read pair is flattened into single reads as in STEP 2, but instead of breaking each read into
+        # kmers, the read is seeded once and checked against each candidate once
+        # the aligned bases are counted in a pileup, and any mismatch that's supported by <= 1 read is removed (we
+        # assume it's erroneous), along with any that fail --minDepth or --minAlleleFraction
+        packed_reference = pack_reference(reference) if args.packed_verify else None
+        if args.chunk_size is not None:
+            read_chunks = parse_flattened_reads_chunks(reads_fn, args.chunk_size)
+        elif args.workers > 1:
+            # split the reads up between the workers
+            read_chunks = split_into_shards([read for read_pair in input_reads for read in read_pair], args.workers)
+        else:
+            read_chunks = [[read for read_pair in input_reads for read in read_pair]]
+        try:
+            if args.pipeline or args.workers > 1:
+                snps = get_snps_pipelined(read_chunks, False, reference_index, reference, args.workers,
+                                          packed_reference, dedup=args.dedup,
+                                          prefetch=args.pipeline, min_depth=args.min_depth,
+                                          min_allele_fraction=args.min_allele_fraction)
+            elif args.checkpoint is not None:
+                snps = get_snps_by_chunk_checkpointed(read_chunks, False, reference_index, reference,
+                                                      args.checkpoint, args.checkpoint_interval, reads_fn, run_stamp,
+                                                      checkpoint,
+                                                      packed_reference, dedup=args.dedup, min_depth=args.min_depth,
+                                                      min_allele_fraction=args.min_allele_fraction)
+            else:
+                snps = get_snps_by_read(read_chunks, reference_index, reference, packed_reference,
+                                        dedup=args.dedup, min_depth=args.min_depth,
+                                        min_allele_fraction=args.min_allele_fraction)
+        except IOError:
+            print("Could not read file: ", reads_fn)
+            sys.exit(1)
+    elif args.mode == 'paired':
+        ###### STEPS 2-5: ALIGN EACH READ PAIR AND FIND THE SNPS FROM THE ALIGNMENTS ######
+        # the read pairs aren't flattened, so that the second read of each pair can be looked for near the first
+        packed_reference = pack_reference(reference) if args.packed_verify else None
+        if args.chunk_size is not None:
+            read_pair_chunks = parse_reads_file_chunks(reads_fn, args.chunk_size)
+        elif args.workers > 1:
+            read_pair_chunks = split_into_shards(input_reads, args.workers)
+        else:
+            read_pair_chunks = [input_reads]
+        try:
+            if args.pipeline or args.workers > 1:
+                snps = get_snps_pipelined(read_pair_chunks, True, reference_index, reference, args.workers,
+                                          packed_reference, dedup=args.dedup,
+                                          prefetch=args.pipeline, min_depth=args.min_depth,
+                                          min_allele_fraction=args.min_allele_fraction)
+            elif args.checkpoint is not None:
+                snps = get_snps_by_chunk_checkpointed(read_pair_chunks, True, reference_index, reference,
+                                                      args.checkpoint, args.checkpoint_interval, reads_fn, run_stamp,
+                                                      checkpoint,
+                                                      packed_reference, dedup=args.dedup, min_depth=args.min_depth,
+                                                      min_allele_fraction=args.min_allele_fraction)
+            else:
+                snps = get_snps_by_pair(read_pair_chunks, reference_index, reference, packed_reference,
+                                        dedup=args.dedup, min_depth=args.min_depth,
+                                        min_allele_fraction=args.min_allele_fraction)
+        except IOError:
+            print("Could not read file: ", reads_fn)
+            sys.exit(1)
+    elif checkpoint is not None:
+        ###### STEPS 2-4: TAKE THE FREQUENT K-MERS FROM THE CHECKPOINT ######
+        # the kmers were counted, filtered and saved before the first checkpoint, so they aren't counted again
+        kmer_checkpoint = read_checkpoint_file(get_kmer_checkpoint_fn(args.checkpoint))
+        if kmer_checkpoint is None:
+            sys.exit(1)
+        if not is_checkpoint_for(kmer_checkpoint, 'kmer', reads_fn, run_stamp):
+            print("Checkpoint is from a different mode, reads file, reference or settings: ",
+                  get_kmer_checkpoint_fn(args.checkpoint))
+            sys.exit(1)
+        kmers = unpack_strings(kmer_checkpoint['kmers'], kmer_checkpoint['kmer_lengths'])
+    elif args.packed_kmers:
+        ###### STEPS 2-4: COUNT THE K-MERS AS PACKED INTEGERS AND REMOVE INFREQUENT K-MERS ######
+        # the kmers are packed into pairs of uint64s and counted with a sort, then any kmers with a frequency <= 1
+        # are removed (we assume they're erroneous), and only the remaining kmers are turned back into strings
+        if args.chunk_size is not None:
+            kmers = get_frequent_kmers_packed_streaming(reads_fn, args.chunk_size, dedup=args.dedup,
+                                                        prefetch=args.pipeline)
+            if kmers is None:
+                sys.exit(1)
+        else:
+            kmers = get_frequent_kmers_packed([read for read_pair in input_reads for read in read_pair],
+                                              dedup=args.dedup)
+    elif args.chunk_size is not None:
+        ###### STEPS 2-4: STREAM THE READS, BREAK THEM INTO K-MERS AND COUNT THE K-MERS CHUNK BY CHUNK ######
+        kmer_to_frequency = get_kmer_frequencies_streaming(reads_fn, args.chunk_size, args.dedup, args.pipeline)
+        if kmer_to_frequency is None:
+            sys.exit(1)
+    else:
+        ###### STEP 2: CONVERT FROM READ-PAIRS TO SINGLE READS ######
+        # in order to avoid issues with variable length read pairs, we will
+        # consider each part of the read pair as its own independent read
+        # therefore, we "flatten" the input_reads list so each read is its own entry
+        input_reads = [read for read_pair in input_reads for read in read_pair]
+
+        ###### STEP 3: BREAK DOWN READS INTO SMALLER K-MERS ######
+        # currently, our reads are 50-mers
+        # we will use k = KMER_SIZE to break them down into KMER_SIZE-mers
+        # with --dedup, identical reads are collapsed first, and each distinct read is broken down once in STEP 4
+        if not args.dedup:
+            kmers = break_into_kmers(input_reads)
+
+        ###### STEP 4: REMOVE INFREQUENT KMERS ######
+        # any kmer with low frequency has a high probability of being erroneous
+
+        # first, map each kmer to the amount of times it occurs
+        if args.dedup:
+            kmer_to_frequency = get_weighted_kmer_frequencies(dedup_reads(input_reads))
+        else:
+            kmer_to_frequency = get_kmer_frequencies(kmers)
 
-    # then, remove any kmers with a frequency <= 1 - we assume they're erroneous
-    kmer_to_frequency = {kmer: freq for kmer, freq in kmer_to_frequency.items() if freq > 1}
+    if args.mode == 'kmer' and not args.packed_kmers and checkpoint is None:
+        # then, remove any kmers with a frequency <= 1 - we assume they're erroneous
+        kmer_to_frequency = {kmer: freq for kmer, freq in kmer_to_frequency.items() if freq > 1}
 
-    # now, we ignore the frequencies for the following reason:
-    # any kmer has a frequency of at least 2, so it will always outnumber the reference genome
-    # so we convert from dictionary back into a list of kmers
-    kmers = list(kmer_to_frequency.keys())
+        # now, we ignore the frequencies for the following reason:
+        # any kmer has a frequency of at least 2, so it will always outnumber the reference genome
+        # so we convert from dictionary back into a list of kmers
+        kmers = list(kmer_to_frequency.keys())
 
     ###### STEP 5: USE HASHING ALGORITHM TO FIND SNPS ######
-    snps = get_snps(kmers, reference_index, reference)
+    if args.mode != 'kmer':
+        # the SNPs were already found in STEPS 2-5
+        pass
+    elif args.checkpoint is not None:
+        # the kmers are aligned in batches, and the SNPs found so far are checkpointed between batches
+        encoded_reference = encode_reference(reference) if args.batch_verify or args.workers > 1 else None
+        packed_reference = pack_reference(reference) if args.packed_verify else None
+        snps = get_snps_checkpointed(kmers, reference_index, reference, args.checkpoint, args.checkpoint_interval,
+                                     reads_fn, run_stamp, checkpoint, encoded_reference, packed_reference,
+                                     args.workers)
+    elif args.workers > 1:
+        snps = get_snps_parallel(kmers, reference_index, encode_reference(reference), args.workers,
+                                 args.packed_verify)
+    else:
+        encoded_reference = encode_reference(reference) if args.batch_verify else None
+        packed_reference = pack_reference(reference) if args.packed_verify else None
+        snps = get_snps(kmers, reference_index, reference, encoded_reference, packed_reference)
+
+    if args.seed_cap is not None:
+        print("Seed cap: ", seed_cap_state['seeds_skipped'], " seeds skipped, ", seed_cap_state['seeds_sampled'],
+              " seeds down-sampled, ", seed_cap_state['candidates_pruned'], " candidate indices pruned")
+
+    if args.seed_cache is not None:
+        num_lookups = seed_cache_state['hits'] + seed_cache_state['misses']
+        print("Seed cache: ", seed_cache_state['hits'], " hits out of ", num_lookups, " lookups (hit rate ",
+              round(seed_cache_state['hits'] / max(num_lookups, 1), 3), "), ", seed_cache_state['evictions'],
+              " evictions")
+
+    # the dedup ratio is the # of reads per distinct read
+    if args.dedup:
+        print("Dedup: ", dedup_state['reads'], " reads, ", dedup_state['distinct_reads'], " distinct, ratio ",
+              round(dedup_state['reads'] / max(dedup_state['distinct_reads'], 1), 3))
+
 
     output_fn = args.output_file
     zip_fn = output_fn + '.zip'
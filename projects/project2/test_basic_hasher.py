@@ -0,0 +1,324 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import basic_hasher
+
+
+# makes reads of an indel (with no sequencing errors) at several offsets around it
+def get_indel_reads(donor, read_length, offsets):
+    return [donor[offset:(offset + read_length)] for offset in offsets]
+
+
+class TestFindIndels(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        random.seed(122)
+        cls.reference = ''.join(random.choice('ACGT') for _ in range(100000))
+        basic_hasher.set_seed_layout(basic_hasher.DEFAULT_SEED_PATTERN, basic_hasher.ERROR_THRESHOLD + 1)
+        cls.reference_index = basic_hasher.index_genome(cls.reference)
+
+    # each read has one indel of 3-8 bases, which should be traced as one event (not split into several gaps)
+    def test_multi_base_indel_is_one_event(self):
+        for length in range(3, 9):
+            for indel_type in ('DEL', 'INS'):
+                with self.subTest(indel_type=indel_type, length=length):
+                    index = 20000 + 5000 * length + (2500 if indel_type == 'INS' else 0)
+                    flank_before = self.reference[(index - 60):index]
+                    if indel_type == 'DEL':
+                        sequence = self.reference[index:(index + length)]
+                        donor = flank_before + self.reference[(index + length):(index + length + 60)]
+                    else:
+                        sequence = ''.join(random.choice('ACGT') for _ in range(length))
+                        donor = flank_before + sequence + self.reference[index:(index + 60)]
+                    expected = basic_hasher.normalize_indel((indel_type, sequence, index), self.reference)
+
+                    # the indel is at least 16 bases from either end of each read (nearer to an end, a few
+                    # mismatches can cost less than a gap)
+                    offsets = [60 - flank for flank in (16, 19, 22, 25)]
+                    reads = get_indel_reads(donor, 50, offsets)
+                    for offset, read in zip(offsets, reads):
+                        # the read starts at index - 60 + offset in the reference
+                        window_start = index - 60 + offset - basic_hasher.INDEL_BAND
+                        window = self.reference[window_start:(window_start + 50 + 2 * basic_hasher.INDEL_BAND)]
+                        codes = basic_hasher.BASE_TO_CODE[basic_hasher.encode_reference(read + window)]
+                        costs = basic_hasher.get_edit_distances(codes[np.newaxis, :50], codes[np.newaxis, 50:])
+                        num_mismatches, indels, _ = basic_hasher.trace_indels(costs[:, 0], read, window,
+                                                                              window_start)
+                        self.assertEqual(num_mismatches, 0)
+                        self.assertEqual(len(indels), 1)
+                        self.assertEqual(basic_hasher.normalize_indel(indels[0], self.reference), expected)
+
+                    insertions, deletions = basic_hasher.find_indels(reads, self.reference_index, self.reference)
+                    called = insertions if indel_type == 'INS' else deletions
+                    self.assertEqual(called, [[expected[1], expected[2]]])
+                    self.assertEqual(insertions + deletions, called)
+
+    # an insertion found in fewer reads than another insertion 3 bases away is dropped, and so is an insertion with a
+    # mismatch 2 bases from it in every read
+    def test_nearby_and_mismatched_indels_are_dropped(self):
+        offsets = [60 - flank for flank in (16, 19, 22, 25)]
+        index = 80000
+        donor = self.reference[(index - 60):index] + 'CAT' + self.reference[index:(index + 60)]
+        nearby_donor = self.reference[(index - 57):(index + 3)] + 'GGA' + self.reference[(index + 3):(index + 63)]
+        reads = get_indel_reads(donor, 50, offsets) + get_indel_reads(nearby_donor, 50, offsets[:2])
+        expected = basic_hasher.normalize_indel(('INS', 'CAT', index), self.reference)
+        self.assertEqual(basic_hasher.find_indels(reads, self.reference_index, self.reference),
+                         ([[expected[1], expected[2]]], []))
+
+        index = 90000
+        after = list(self.reference[index:(index + 60)])
+        after[2] = 'A' if after[2] != 'A' else 'C'
+        donor = self.reference[(index - 60):index] + 'CAT' + ''.join(after)
+        reads = get_indel_reads(donor, 50, offsets)
+        self.assertEqual(basic_hasher.find_indels(reads, self.reference_index, self.reference), ([], []))
+
+
+class TestReferenceTypes(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        random.seed(6)
+        cls.reference = ''.join(random.choice('ACGT') for _ in range(5000))
+        # a few Ns, and lines of different lengths with trailing spaces and CRLFs like a real reference file
+        cls.reference = cls.reference[:1000] + 'NNNN' + cls.reference[1004:]
+        lines = [cls.reference[i:(i + 80)] for i in range(0, len(cls.reference), 80)]
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as ref_file:
+            ref_file.write('>ref_test\r\n' + ' \r\n'.join(lines) + '\n')
+            cls.ref_fn = ref_file.name
+        basic_hasher.set_seed_layout(basic_hasher.DEFAULT_SEED_PATTERN, basic_hasher.ERROR_THRESHOLD + 1)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.ref_fn)
+
+    def test_parse_ref_file_output_types(self):
+        self.assertEqual(basic_hasher.parse_ref_file(self.ref_fn), self.reference)
+        self.assertEqual(basic_hasher.parse_ref_file(self.ref_fn, 'bytes'), self.reference.encode('ascii'))
+        self.assertEqual(basic_hasher.parse_ref_file(self.ref_fn, 'bytearray'), self.reference.encode('ascii'))
+        codes = basic_hasher.parse_ref_file(self.ref_fn, 'codes')
+        self.assertEqual(codes.tolist(), ['ACGTN'.index(base) for base in self.reference])
+
+    # every stage gives the same results whatever type the reference was parsed as
+    def test_stages_accept_every_type(self):
+        # kmers with 1-2 SNPs (and one with an N in the reference section), each seen twice
+        kmers = []
+        for index in range(0, 4900, 97):
+            kmer = list(self.reference[index:(index + basic_hasher.KMER_SIZE)])
+            kmer[7] = 'A' if kmer[7] != 'A' else 'C'
+            if index % 2:
+                kmer[40] = 'G' if kmer[40] != 'G' else 'T'
+            kmers.append(''.join(kmer))
+        alignments = [(kmer, index) for kmer, index in zip(kmers, range(0, 4900, 97))] * 2
+        pileup = basic_hasher.add_to_pileup(alignments, basic_hasher.create_pileup(len(self.reference)))
+
+        expected = None
+        for output_type in ('str', 'bytes', 'bytearray', 'codes'):
+            with self.subTest(output_type=output_type):
+                reference = basic_hasher.parse_ref_file(self.ref_fn, output_type)
+                dict_index = basic_hasher.index_genome(reference)
+                array_index = basic_hasher.index_genome_array(reference)
+                encoded_reference = basic_hasher.encode_reference(reference)
+                results = (dict_index,
+                           [array.tolist() for array in array_index],
+                           encoded_reference.tobytes(),
+                           basic_hasher.get_snps(kmers, dict_index, reference),
+                           basic_hasher.get_snps(kmers, array_index, reference, encoded_reference),
+                           basic_hasher.align_reads(kmers, array_index, reference),
+                           basic_hasher.call_pileup_snps(pileup, reference),
+                           basic_hasher.find_tandem_repeats(reference),
+                           basic_hasher.normalize_indel(('DEL', self.reference[3000:3002], 3000), reference))
+                if expected is None:
+                    expected = results
+                    self.assertEqual(len(results[3]), len(kmers) + len(kmers) // 2)
+                self.assertEqual(results, expected)
+
+
+class TestCopyNumberAndRepeats(unittest.TestCase):
+
+    # a gain to twice the median coverage and a loss to a third of it are each one segment, with breakpoints to the
+    # base even when they are inside a window, while the coverage falling off at the ends of the genome and a blip of
+    # a few bases are not segments
+    def test_segment_coverage_gain_and_loss(self):
+        coverage = np.full(2000, 30.0)
+        coverage[:40] = np.linspace(0, 30, 40)
+        coverage[-40:] = np.linspace(30, 0, 40)
+        coverage[510:815] = 60
+        coverage[1190:1413] = 10
+        coverage[1700:1710] = 0
+        segments = basic_hasher.segment_coverage(coverage)
+        self.assertEqual([(start, end) for start, end, _ in segments], [(510, 815), (1190, 1413)])
+        self.assertAlmostEqual(segments[0][2], 2.0)
+        self.assertAlmostEqual(segments[1][2], 1 / 3)
+
+    # with no coverage over most of the genome there's no median to compare to, so no segments (and no division by 0)
+    def test_segment_coverage_mostly_uncovered(self):
+        for covered_length in (0, 100, 1400):
+            with self.subTest(covered_length=covered_length):
+                coverage = np.zeros(3000)
+                coverage[:covered_length] = 30
+                with np.errstate(all='raise'):
+                    self.assertEqual(basic_hasher.segment_coverage(coverage), [])
+
+    # an extra copy of a repeat in the donor genome leaves a gap in the coverage, and is called from the reads across
+    # it as the repeat's unit with the indices of its copies in the reference and of the extra copy
+    def test_find_cnvs_extra_copy(self):
+        random.seed(150)
+        unit = ''.join(random.choice('ACGT') for _ in range(30))
+        background = ''.join(random.choice('ACGT') for _ in range(3000))
+        reference = background[:700] + unit + background[700:1600] + unit + background[1600:]
+        # the gap in the coverage is deepest at the extra copy, which is in the middle of a window
+        donor = reference[:2325] + unit + reference[2325:]
+        expected = basic_hasher.normalize_indel(('INS', unit, 2325), reference)
+        reference_index = basic_hasher.index_genome(reference)
+
+        reads = [donor[start:(start + 50)] for start in range(0, len(donor) - 49, 4)]
+        failed_reads = []
+        alignments = basic_hasher.align_reads(reads, reference_index, reference, failed_reads=failed_reads)
+        coverage_events = basic_hasher.create_coverage_events(len(reference))
+        basic_hasher.add_coverage_events(alignments, coverage_events)
+        coverage = basic_hasher.get_coverage(coverage_events)
+
+        self.assertEqual(basic_hasher.find_cnvs(coverage, failed_reads, reference_index, reference),
+                         [[unit, 700, 1630, expected[2]]])
+
+    # runs of one base are not reported as repeats of a 2-base unit, and a run of ACAC... is only reported once
+    # (as a repeat of AC, not again as a repeat of ACAC)
+    def test_tandem_repeat_units_are_primitive(self):
+        random.seed(15)
+        background = ''.join(random.choice('ACGT') for _ in range(4000))
+        reference = (background[:1000] + 'A' * 20 + background[1000:2000] + 'AC' * 10 + background[2000:3000]
+                     + 'ACG' * 6 + background[3000:])
+        repeats = basic_hasher.find_tandem_repeats(reference)
+
+        self.assertFalse([repeat for repeat in repeats if len(set(repeat[0])) == 1])
+        self.assertFalse([repeat for repeat in repeats if 1000 <= repeat[1] < 1020])
+        ac_repeats = [repeat for repeat in repeats if 2015 <= repeat[1] <= 2025]
+        self.assertEqual(len(ac_repeats), 1)
+        self.assertIn('ACACACACACACACACACAC', ac_repeats[0][0] * 2)
+        self.assertEqual(set(ac_repeats[0][0]), {'A', 'C'})
+        acg_repeats = [repeat for repeat in repeats if 3035 <= repeat[1] <= 3045]
+        self.assertEqual(len(acg_repeats), 1)
+        self.assertEqual(set(acg_repeats[0][0]), {'A', 'C', 'G'})
+
+
+class TestCallPileupSnps(unittest.TestCase):
+
+    # at each index, the reads are (base, # of reads) counts, on a reference of ACGTACGT...
+    def setUp(self):
+        self.reference = 'ACGT' * 5
+        self.pileup = basic_hasher.create_pileup(len(self.reference))
+        counts = {1: {'A': 1},                      # 1 read of A over C: too little support
+                  3: {'A': 2},                      # 2 reads of A over T: depth 2, fraction 1
+                  6: {'G': 7, 'C': 3},              # 3 of 10 reads: exactly the default fraction
+                  9: {'C': 5, 'A': 2, 'T': 3},      # the most common base other than C is T, at a fraction of 0.3
+                  14: {'G': 8, 'A': 2},             # 2 of 10 reads: under the default fraction
+                  17: {'C': 20}}                    # matches the reference
+        for index, base_counts in counts.items():
+            for base, count in base_counts.items():
+                self.pileup[index, 'ACGT'.index(base)] = count
+
+    def call(self, **thresholds):
+        return basic_hasher.call_pileup_snps(self.pileup, self.reference, **thresholds)
+
+    def test_default_thresholds(self):
+        self.assertEqual(self.call(), [['T', 'A', 3], ['G', 'C', 6], ['C', 'T', 9]])
+
+    def test_allele_fraction_threshold(self):
+        self.assertEqual(self.call(min_allele_fraction=0.0),
+                         [['T', 'A', 3], ['G', 'C', 6], ['C', 'T', 9], ['G', 'A', 14]])
+        self.assertEqual(self.call(min_allele_fraction=0.2),
+                         [['T', 'A', 3], ['G', 'C', 6], ['C', 'T', 9], ['G', 'A', 14]])
+        self.assertEqual(self.call(min_allele_fraction=0.31), [['T', 'A', 3]])
+
+    def test_depth_and_support_thresholds(self):
+        self.assertEqual(self.call(min_depth=2), self.call())
+        self.assertEqual(self.call(min_depth=3), [['G', 'C', 6], ['C', 'T', 9]])
+        self.assertEqual(self.call(min_depth=11), [])
+        self.assertEqual(self.call(min_support=3), [['G', 'C', 6], ['C', 'T', 9]])
+        self.assertEqual(self.call(min_support=1, min_allele_fraction=0.0)[0], ['C', 'A', 1])
+
+
+class TestMinimizers(unittest.TestCase):
+
+    def tearDown(self):
+        basic_hasher.set_seed_layout(basic_hasher.DEFAULT_SEED_PATTERN, basic_hasher.ERROR_THRESHOLD + 1)
+
+    # the batched minimizers (iter_seeds and get_minimizer_rows) are the same as the minimizers found one sequence at
+    # a time (get_minimizers), for kmers and reads of mixed lengths, with Ns and runs of one base (which tie)
+    def test_batched_minimizers_match_get_minimizers(self):
+        random.seed(19)
+        sequences = []
+        for number in range(300):
+            length = random.choice((basic_hasher.KMER_SIZE, 50, 45, 20, 10))
+            sequence = [random.choice('ACGT') for _ in range(length)]
+            for _ in range(number % 4):
+                sequence[random.randrange(length)] = 'N'
+            if number % 7 == 0:
+                sequence[5:25] = 'A' * 20
+            sequences.append(''.join(sequence)[:length])
+
+        for pattern, window in (('1' * 16, 1), ('1' * 16, 5), ('1' * 8, 3), ('1101101101101101', 5),
+                                ('1' * 12, 40)):
+            with self.subTest(pattern=pattern, window=window):
+                basic_hasher.set_seed_layout(pattern, basic_hasher.ERROR_THRESHOLD + 1, window)
+                expected = [basic_hasher.get_minimizers(sequence) for sequence in sequences]
+                # a small batch size, so that some lengths are split across batches
+                with mock.patch.object(basic_hasher, 'MINIMIZER_BATCH_SIZE', 37):
+                    self.assertEqual(list(basic_hasher.iter_seeds(sequences)), expected)
+                self.assertTrue(any(expected))
+                self.assertTrue(any('N' in sequence and seeds for sequence, seeds in zip(sequences, expected)))
+
+
+class TestCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(20)
+        self.reference = ''.join(random.choice('ACGT') for _ in range(2000))
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.reads_fn = os.path.join(self.tmp_dir.name, 'reads.txt')
+        with open(self.reads_fn, 'w') as reads_file:
+            reads_file.write('>reads_test\n' + self.reference[:50] + ',' + self.reference[100:150] + '\n')
+        basic_hasher.set_seed_layout(basic_hasher.DEFAULT_SEED_PATTERN, basic_hasher.ERROR_THRESHOLD + 1)
+
+    def tearDown(self):
+        basic_hasher.set_seed_layout(basic_hasher.DEFAULT_SEED_PATTERN, basic_hasher.ERROR_THRESHOLD + 1)
+        basic_hasher.seed_cap_state['cap'] = None
+        self.tmp_dir.cleanup()
+
+    # a checkpoint is only resumed with the same mode, reference, seed layout, seed cap and SNP thresholds
+    def test_checkpoint_is_for_the_same_run(self):
+        checkpoint_fn = os.path.join(self.tmp_dir.name, 'checkpoint.npz')
+        run_stamp = basic_hasher.get_run_stamp(self.reference, 0, 0.3)
+        basic_hasher.save_checkpoint(checkpoint_fn, 'read', self.reads_fn, run_stamp, num_reads_done=1)
+        checkpoint = basic_hasher.read_checkpoint_file(checkpoint_fn)
+        self.assertTrue(basic_hasher.is_checkpoint_for(checkpoint, 'read', self.reads_fn, run_stamp))
+        # the hash doesn't depend on the type the reference was parsed as
+        self.assertTrue(basic_hasher.is_checkpoint_for(
+            checkpoint, 'read', self.reads_fn, basic_hasher.get_run_stamp(bytearray(self.reference, 'ascii'), 0, 0.3)))
+
+        self.assertFalse(basic_hasher.is_checkpoint_for(checkpoint, 'paired', self.reads_fn, run_stamp))
+        other_reference = self.reference[:1000] + ('A' if self.reference[1000] != 'A' else 'C') + self.reference[1001:]
+        self.assertFalse(basic_hasher.is_checkpoint_for(checkpoint, 'read', self.reads_fn,
+                                                        basic_hasher.get_run_stamp(other_reference, 0, 0.3)))
+        for min_depth, min_allele_fraction in ((3, 0.3), (0, 0.4)):
+            with self.subTest(min_depth=min_depth, min_allele_fraction=min_allele_fraction):
+                self.assertFalse(basic_hasher.is_checkpoint_for(
+                    checkpoint, 'read', self.reads_fn,
+                    basic_hasher.get_run_stamp(self.reference, min_depth, min_allele_fraction)))
+        for pattern, num_parts, window, cap in (('1' * 12, 3, None, None), ('1' * 16, 4, None, None),
+                                                ('1' * 16, 3, 5, None), ('1' * 16, 3, None, 100)):
+            with self.subTest(pattern=pattern, num_parts=num_parts, window=window, cap=cap):
+                basic_hasher.set_seed_layout(pattern, num_parts, window)
+                basic_hasher.seed_cap_state['cap'] = cap
+                self.assertFalse(basic_hasher.is_checkpoint_for(
+                    checkpoint, 'read', self.reads_fn, basic_hasher.get_run_stamp(self.reference, 0, 0.3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,39 @@ import sys
 import os
 import zipfile
 import argparse
+import itertools
+import numpy as np
+import multiprocessing
 sys.path.insert(0, os.path.abspath(".."))
 sys.path.insert(0, os.path.abspath("../.."))
 
+# the length of the kmers that the reads are broken into (the nodes of the de Bruijn graph are (KMER_SIZE - 1)-mers)
+KMER_SIZE = 25
+
+# maps each base (as a byte) to its 2-bit code: A=0, C=1, G=2, T=3 (anything else maps to 4)
+BASE_TO_CODE = np.full(256, 4, dtype=np.uint8)
+BASE_TO_CODE[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+
+# maps each 2-bit code back to its base
+CODE_TO_BASE = 'ACGT'
+
+# the # of bits set in each 4-bit edge mask, so that the degree of a node can be read off its mask
+MASK_DEGREES = np.array([bin(mask).count('1') for mask in range(16)], dtype=np.uint8)
+
+# with --packedKmers: the number of read pairs in each chunk of the reads file (unless --chunkSize is given), and the
+# number of chunks of kmers that can be queued up for each worker process
+PACKED_CHUNK_SIZE = 50000
+PARTITION_QUEUE_SIZE = 4
+
+# a 64-bit odd multiplier (from the golden ratio) that mixes the bits of a packed kmer, so that the kmers are spread
+# evenly across the partitions
+KMER_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# with --bloomSize: the number of counters of the counting Bloom filter that each kmer adds 1 to, and the # of times
+# a kmer has to be seen (by the filter) before it's counted exactly
+BLOOM_NUM_HASHES = 3
+BLOOM_MIN_COUNT = 2
+
 
 def parse_reads_file(reads_fn):
     """
@@ -36,6 +66,45 @@ def parse_reads_file(reads_fn):
         return None
 
 
+def parse_reads_file_chunks(reads_fn, chunk_size):
+    """
+    :param reads_fn: the file containing all of the reads
+    :param chunk_size: the number of paired-end reads in each chunk
+    :return: a generator of lists of (at most chunk_size) paired-end reads, so that only one chunk of the reads
+             file has to be in memory at a time
+    """
+    with open(reads_fn, 'r') as rFile:
+        print("Parsing Reads")
+        first_line = True
+        chunk = []
+        for line in rFile:
+            if first_line:
+                first_line = False
+                continue
+            chunk.append(line.strip().split(','))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def parse_reads_file_blocks(reads_fn, chunk_size):
+    """
+    :param reads_fn: the file containing all of the reads
+    :param chunk_size: the number of paired-end reads in each block
+    :return: a generator of blocks of (at most chunk_size) lines of the reads file, each as one unparsed string,
+             so that the lines can be split into reads somewhere else (see get_block_reads)
+    """
+    with open(reads_fn, 'r') as rFile:
+        print("Parsing Reads")
+        rFile.readline()
+        while True:
+            block = ''.join(itertools.islice(rFile, chunk_size))
+            if not block:
+                return
+            yield block
+
+
 """
     TODO: Use this space to implement any additional functions you might need
 """
@@ -98,19 +167,454 @@ def get_node_degrees(adjacency_list):
 
     return node_degrees
 
-# returns all maximal non-branching paths in De Bruijn Graph
+# returns the reverse of an adjacency list: each node -> the nodes with an edge to it
+def get_predecessors(adjacency_list):
+    predecessors = {}
+    for outgoing_node, incoming_nodes in adjacency_list.items():
+        for incoming_node in incoming_nodes:
+            if incoming_node in predecessors:
+                predecessors[incoming_node].append(outgoing_node)
+            else:
+                predecessors[incoming_node] = [outgoing_node]
+
+    return predecessors
+
+# removes the edge (outgoing_node, incoming_node) from an adjacency list and its predecessors, along with any node
+# that's left without edges in either of them
+def remove_edge(adjacency_list, predecessors, outgoing_node, incoming_node):
+    adjacency_list[outgoing_node].remove(incoming_node)
+    if not adjacency_list[outgoing_node]:
+        del adjacency_list[outgoing_node]
+    predecessors[incoming_node].remove(outgoing_node)
+    if not predecessors[incoming_node]:
+        del predecessors[incoming_node]
+
+# follows the path that starts with the edge (start_node, next_node) through 1-in-1-out nodes, and returns it up to
+# the first node that isn't a 1-in-1-out node, or None if it has more than max_length edges
+# next_nodes and prev_nodes are the adjacency list and its predecessors, or the other way around to follow the path
+# backwards
+def follow_non_branching_path(start_node, next_node, next_nodes, prev_nodes, max_length):
+    path = [start_node, next_node]
+    while len(next_nodes.get(next_node, ())) == 1 and len(prev_nodes.get(next_node, ())) == 1:
+        if len(path) > max_length:
+            return None
+        next_node = next_nodes[next_node][0]
+        path.append(next_node)
+
+    return path if len(path) - 1 <= max_length else None
+
+# removes tips from the de Bruijn graph: dead-end paths of at most max_length edges (kmers) that join the rest of the
+# graph at a node with another edge on the same side, which are usually made by errors near the end of a read
+# the adjacency list and its predecessors are changed in place, and the # of tips removed is returned
+# a worklist holds the nodes that can start a tip: at first every dead end, and then only the nodes that lost an
+# edge, so each node is only looked at again when a tip next to it is removed
+def clip_tips(adjacency_list, predecessors, max_length):
+    worklist = [node for node in set(adjacency_list) | set(predecessors)
+                if node not in adjacency_list or node not in predecessors]
+    num_tips = 0
+
+    while worklist:
+        node = worklist.pop()
+
+        # a tip can start with no edges in and one edge out, or (backwards) with no edges out and one edge in
+        for next_nodes, prev_nodes in ((adjacency_list, predecessors), (predecessors, adjacency_list)):
+            if node in prev_nodes or len(next_nodes.get(node, ())) != 1:
+                continue
+
+            tip = follow_non_branching_path(node, next_nodes[node][0], next_nodes, prev_nodes, max_length)
+            if tip is None or len(prev_nodes.get(tip[-1], ())) < 2:
+                continue
+
+            for i in range(len(tip) - 1):
+                if next_nodes is adjacency_list:
+                    remove_edge(adjacency_list, predecessors, tip[i], tip[i + 1])
+                else:
+                    remove_edge(adjacency_list, predecessors, tip[i + 1], tip[i])
+            worklist.append(tip[-1])
+            num_tips += 1
+            break
+
+    return num_tips
+
+# returns the average frequency of the kmers (edges) along a path of nodes
+def get_path_coverage(path, kmer_to_frequency):
+    frequencies = [kmer_to_frequency.get(path[i] + path[i + 1][-1], 0) for i in range(len(path) - 1)]
+    return sum(frequencies) / len(frequencies)
+
+# pops bubbles in the de Bruijn graph: when two or more paths of at most max_length edges (kmers) go from the same
+# node to the same node through only 1-in-1-out nodes, only the path with the highest average kmer frequency is
+# kept, since the others are usually made by an error in the middle of some reads
+# the adjacency list and its predecessors are changed in place, and the # of paths removed is returned
+# a worklist holds the nodes that can start a bubble: at first every node with more than one edge out, and then only
+# the nodes next to a removed path, since removing a path can turn a bigger bubble around it into a simple one
+def pop_bubbles(adjacency_list, predecessors, kmer_to_frequency, max_length):
+    worklist = [node for node, incoming_nodes in adjacency_list.items() if len(incoming_nodes) > 1]
+    num_popped = 0
+
+    while worklist:
+        start_node = worklist.pop()
+        if len(adjacency_list.get(start_node, ())) < 2:
+            continue
+
+        # group the short paths out of start_node by the node that they end at
+        end_node_to_paths = {}
+        for next_node in adjacency_list[start_node]:
+            path = follow_non_branching_path(start_node, next_node, adjacency_list, predecessors, max_length)
+            if path is not None:
+                end_node_to_paths.setdefault(path[-1], []).append(path)
+
+        for paths in end_node_to_paths.values():
+            if len(paths) < 2:
+                continue
+            paths.sort(key=lambda path: get_path_coverage(path, kmer_to_frequency), reverse=True)
+            for path in paths[1:]:
+                for i in range(len(path) - 1):
+                    remove_edge(adjacency_list, predecessors, path[i], path[i + 1])
+                num_popped += 1
+
+            # start_node and the end node may now be 1-in-1-out nodes, so look again from the branching nodes
+            # just before them
+            for node in (start_node, paths[0][-1]):
+                worklist.append(node)
+                if len(predecessors.get(node, ())) == 1:
+                    path = follow_non_branching_path(node, predecessors[node][0], predecessors, adjacency_list,
+                                                     max_length)
+                    if path is not None:
+                        worklist.append(path[-1])
+
+    return num_popped
+
+# packs kmers of length k (at most 32) into uint64s with 2 bits per base, with the first base in the highest bits
+# any kmer with a base other than A, C, G or T is dropped
+def encode_kmers(kmers, k):
+    if len(kmers) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    codes = BASE_TO_CODE[np.frombuffer(''.join(kmers).encode('ascii'), dtype=np.uint8)].reshape(-1, k)
+    codes = codes[(codes < 4).all(axis=1)]
+
+    packed_kmers = np.zeros(len(codes), dtype=np.uint64)
+    for i in range(k):
+        packed_kmers = (packed_kmers << np.uint64(2)) | codes[:, i]
+    return packed_kmers
+
+# turns a packed node (or kmer) back into a string of its length bases
+def decode_node(node, length):
+    node = int(node)
+    return ''.join(CODE_TO_BASE[(node >> (2 * i)) & 3] for i in range(length - 1, -1, -1))
+
+# turns an array of packed kmers of length k back into a list of strings
+def decode_kmers(packed_kmers, k):
+    bases = np.empty((len(packed_kmers), k), dtype=np.uint8)
+    for i in range(k):
+        codes = (packed_kmers >> np.uint64(2 * (k - 1 - i))) & np.uint64(3)
+        bases[:, i] = np.frombuffer(CODE_TO_BASE.encode('ascii'), dtype=np.uint8)[codes.astype(np.intp)]
+
+    all_bases = bases.tobytes().decode('ascii')
+    return [all_bases[i:(i + k)] for i in range(0, len(all_bases), k)]
+
+# packed version of break_into_kmers: packs every kmer of length k of the reads into a uint64, without making a
+# string for each kmer
+# kmers with a base other than A, C, G or T are dropped
+def pack_read_kmers(reads, k):
+    all_packed_kmers = [np.zeros(0, dtype=np.uint64)]
+    read_lengths = np.array([len(read) for read in reads], dtype=np.int64)
+
+    # the reads are packed in groups of the same length, so that each group is a 2D array of base codes
+    # (stored as base position x read, so that each step below works on contiguous rows)
+    for read_length in np.unique(read_lengths[read_lengths >= k]).tolist():
+        group = [read for read in reads if len(read) == read_length]
+        codes = BASE_TO_CODE[np.frombuffer(''.join(group).encode('ascii'), dtype=np.uint8)]
+        codes = np.ascontiguousarray(codes.reshape(len(group), read_length).T)
+        num_kmers = read_length - k + 1
+
+        # roll the encoding across each read, one base position of the kmer at a time
+        packed_kmers = np.zeros((num_kmers, len(group)), dtype=np.uint64)
+        valid = np.ones((num_kmers, len(group)), dtype=bool)
+        for i in range(k):
+            packed_kmers <<= np.uint64(2)
+            packed_kmers |= (codes[i:(i + num_kmers)] & 3).astype(np.uint64)
+            valid &= codes[i:(i + num_kmers)] < 4
+
+        all_packed_kmers.append(packed_kmers[valid])
+
+    return np.concatenate(all_packed_kmers)
+
+# returns the reads of a block of lines of the reads file (from parse_reads_file_blocks), both ends of each pair
+def get_block_reads(block):
+    return block.replace(',', '\n').split()
+
+# packed version of get_kmer_frequencies: sorts the packed kmers and counts equal kmers
+# returns (kmers, counts) with one entry per distinct kmer, in sorted order
+# if counts is given, each input kmer counts that many times, which is how the counts of two chunks are merged
+def count_packed_kmers(packed_kmers, counts=None):
+    if counts is None:
+        counts = np.ones(len(packed_kmers), dtype=np.int64)
+    if len(packed_kmers) == 0:
+        return packed_kmers, counts
+
+    order = np.argsort(packed_kmers)
+    packed_kmers, counts = packed_kmers[order], counts[order]
+
+    is_first = np.ones(len(packed_kmers), dtype=bool)
+    is_first[1:] = packed_kmers[1:] != packed_kmers[:-1]
+    starts = np.flatnonzero(is_first)
+    return packed_kmers[starts], np.add.reduceat(counts, starts)
+
+# merges a list of packed kmer counts (from count_packed_kmers) into one
+def merge_packed_kmer_counts(all_counts):
+    if not all_counts:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    if len(all_counts) == 1:
+        return all_counts[0]
+
+    packed_kmers, counts = [np.concatenate(arrays) for arrays in zip(*all_counts)]
+    return count_packed_kmers(packed_kmers, counts)
+
+# counts the packed kmers in an iterable of arrays of packed kmers (one array per chunk of reads), then removes any
+# kmers with a frequency < min_frequency
+# returns (kmers, counts) of the remaining kmers, in sorted order
+def count_kmer_chunks(kmer_chunks, min_frequency):
+    # the counts of each chunk are kept separately until they add up to more entries than the merged counts,
+    # so that the merged counts are only re-sorted a logarithmic number of times
+    merged_counts = []
+    chunk_counts = []
+    num_chunk_entries = 0
+
+    for packed_kmers in kmer_chunks:
+        chunk_counts.append(count_packed_kmers(packed_kmers))
+        num_chunk_entries += len(chunk_counts[-1][0])
+        if not merged_counts or num_chunk_entries > len(merged_counts[0][0]):
+            merged_counts = [merge_packed_kmer_counts(merged_counts + chunk_counts)]
+            chunk_counts = []
+            num_chunk_entries = 0
+
+    packed_kmers, counts = merge_packed_kmer_counts(merged_counts + chunk_counts)
+    is_frequent = counts >= min_frequency
+    return packed_kmers[is_frequent], counts[is_frequent]
+
+# returns the chunks put on a queue, until a None
+def get_queued_chunks(chunk_queue):
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is None:
+            return
+        yield chunk
+
+# returns the partition (out of num_partitions) of each packed kmer, by its hash
+def get_kmer_partitions(packed_kmers, num_partitions):
+    return ((packed_kmers * KMER_HASH_MULTIPLIER) >> np.uint64(32)) % np.uint64(num_partitions)
+
+# returns an empty counting Bloom filter with size counters (one byte each)
+def create_bloom_filter(size):
+    return np.zeros(size, dtype=np.uint8)
+
+# returns the counters of a Bloom filter with size counters that each packed kmer maps to, one array per hash
+# (with double hashing: the i-th counter is first_hash + i * second_hash, modulo size)
+# the arrays are made one at a time, so that only one of them is in memory at once
+def get_bloom_indices(packed_kmers, size):
+    hashes = packed_kmers * KMER_HASH_MULTIPLIER
+    first_hashes = hashes >> np.uint64(32)
+    second_hashes = (hashes & np.uint64(0xFFFFFFFF)) | np.uint64(1)
+    for i in range(BLOOM_NUM_HASHES):
+        yield (first_hashes + np.uint64(i) * second_hashes) % np.uint64(size)
+
+# adds packed kmers to a counting Bloom filter: each kmer adds 1 to each of its counters, which stop at 255
+def add_to_bloom_filter(bloom_filter, packed_kmers):
+    for indices in get_bloom_indices(packed_kmers, len(bloom_filter)):
+        indices, counts = np.unique(indices, return_counts=True)
+        bloom_filter[indices] = np.minimum(bloom_filter[indices] + counts, 255)
+
+# returns whether each packed kmer was added to the Bloom filter at least min_count times
+# a counter can only be too high (when other kmers share it), so no kmer that was added min_count times is missed,
+# but some kmers that were added fewer times get through (see get_bloom_false_positive_rate)
+def check_bloom_filter(bloom_filter, packed_kmers, min_count):
+    is_frequent = np.ones(len(packed_kmers), dtype=bool)
+    for indices in get_bloom_indices(packed_kmers, len(bloom_filter)):
+        is_frequent &= bloom_filter[indices] >= min_count
+    return is_frequent
+
+# returns the estimated false-positive rate of a Bloom filter: a kmer that was only seen once gets through if each of
+# its counters was also hit by some other kmer, which is about the fraction of counters that were hit at all
+def get_bloom_false_positive_rate(bloom_filter):
+    return (np.count_nonzero(bloom_filter) / len(bloom_filter)) ** BLOOM_NUM_HASHES
+
+# two-pass version of count_kmer_chunks with a counting Bloom filter of bloom_size counters: the kmers of the first
+# pass of chunks are only added to the filter, and in the second pass of the same chunks, only the kmers that were
+# seen at least BLOOM_MIN_COUNT times are counted
+# most of the error kmers are only seen once, so they never make it into the counts, and the counts of the kmers
+# that do are still exact
+# returns ((kmers, counts), estimated false-positive rate of the filter)
+def count_screened_kmer_chunks(first_pass_chunks, second_pass_chunks, min_frequency, bloom_size):
+    bloom_filter = create_bloom_filter(bloom_size)
+    for packed_kmers in first_pass_chunks:
+        add_to_bloom_filter(bloom_filter, packed_kmers)
+
+    screened_chunks = (packed_kmers[check_bloom_filter(bloom_filter, packed_kmers, BLOOM_MIN_COUNT)]
+                       for packed_kmers in second_pass_chunks)
+    return count_kmer_chunks(screened_chunks, min_frequency), get_bloom_false_positive_rate(bloom_filter)
+
+# runs in each worker process of get_frequent_kmers_packed: counts the chunks of kmers of one partition as they come
+# in on kmer_queue, and puts the frequent kmers of the partition and the false-positive rate of its Bloom filter
+# (or None) on result_queue
+# if bloom_size is given, the chunks come in twice (each pass ending with a None), see count_screened_kmer_chunks
+# if the counting fails, the error is put on result_queue instead (to be raised again in the main process), and the
+# rest of the chunks are taken off kmer_queue so that the main process doesn't get stuck waiting to put them on it
+def count_kmer_partition(kmer_queue, result_queue, min_frequency, bloom_size=None):
+    passes = [get_queued_chunks(kmer_queue) for _ in range(1 if bloom_size is None else 2)]
+    try:
+        if bloom_size is None:
+            result_queue.put((count_kmer_chunks(passes[0], min_frequency), None))
+        else:
+            result_queue.put(count_screened_kmer_chunks(passes[0], passes[1], min_frequency, bloom_size))
+    except Exception as error:
+        result_queue.put(error)
+        for kmer_chunks in passes:
+            for _ in kmer_chunks:
+                pass
+
+# runs in each packing process of get_frequent_kmers_packed: packs the kmers of the blocks of the reads file that
+# come in on block_queue (until a None), and puts the kmers of each partition on the kmer_queue of that partition
+# if the packing fails, the error is put on result_queue instead (to be raised again in the main process), and the
+# rest of the blocks are taken off block_queue so that the main process doesn't get stuck waiting to put them on it
+def pack_kmer_partitions(block_queue, kmer_queues, result_queue, k):
+    blocks = get_queued_chunks(block_queue)
+    try:
+        for block in blocks:
+            packed_kmers = pack_read_kmers(get_block_reads(block), k)
+            partitions = get_kmer_partitions(packed_kmers, len(kmer_queues))
+            for partition, kmer_queue in enumerate(kmer_queues):
+                kmer_queue.put(packed_kmers[partitions == partition])
+    except Exception as error:
+        result_queue.put(error)
+        for _ in blocks:
+            pass
+
+# packed version of STEPS 1-3: streams the reads file chunk_size read pairs at a time, packs the kmers of length k of
+# each chunk and counts them, then removes any kmers with a frequency < min_frequency
+# with num_workers > 1, the main process only reads the blocks of lines of the file, and num_workers packing
+# processes split them into reads and pack their kmers; the kmers are hash-partitioned across num_workers counting
+# processes, and each counting process counts and filters its own partition, so the partitions are never merged
+# into one table
+# if bloom_size is given, the reads file is read twice, and only the kmers that a counting Bloom filter (of
+# bloom_size counters in all, split evenly across the partitions) has seen more than once are counted exactly
+# returns (kmers, counts) of the frequent kmers (sorted within each partition), or None if the file can't be read
+def get_frequent_kmers_packed(reads_fn, k, chunk_size, min_frequency, num_workers=1, bloom_size=None):
+    def get_blocks():
+        count = 0
+        for block in parse_reads_file_blocks(reads_fn, chunk_size):
+            yield block
+            count += block.count('\n')
+            print(count, " reads done")
+
+    try:
+        if num_workers == 1:
+            kmer_chunks = [(pack_read_kmers(get_block_reads(block), k) for block in get_blocks())
+                           for _ in range(1 if bloom_size is None else 2)]
+            if bloom_size is None:
+                return count_kmer_chunks(kmer_chunks[0], min_frequency)
+            frequent_kmers, false_positive_rate = count_screened_kmer_chunks(kmer_chunks[0], kmer_chunks[1],
+                                                                             min_frequency, bloom_size)
+            print("Bloom filter: ", bloom_size, " counters, estimated false-positive rate ",
+                  round(false_positive_rate, 6))
+            return frequent_kmers
+
+        partition_bloom_size = None if bloom_size is None else max(bloom_size // num_workers, 1)
+        block_queue = multiprocessing.Queue(PARTITION_QUEUE_SIZE * num_workers)
+        kmer_queues = [multiprocessing.Queue(PARTITION_QUEUE_SIZE) for _ in range(num_workers)]
+        result_queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=count_kmer_partition, daemon=True,
+                                           args=(kmer_queue, result_queue, min_frequency, partition_bloom_size))
+                   for kmer_queue in kmer_queues]
+        for worker in workers:
+            worker.start()
+
+        for _ in range(1 if bloom_size is None else 2):
+            packers = [multiprocessing.Process(target=pack_kmer_partitions, daemon=True,
+                                               args=(block_queue, kmer_queues, result_queue, k))
+                       for _ in range(num_workers)]
+            for packer in packers:
+                packer.start()
+            try:
+                for block in get_blocks():
+                    block_queue.put(block)
+            finally:
+                # each pass only ends once every packing process has put all of its kmers on the kmer queues
+                for _ in packers:
+                    block_queue.put(None)
+                for packer in packers:
+                    packer.join()
+                for kmer_queue in kmer_queues:
+                    kmer_queue.put(None)
+
+        # the partitions don't share any kmers, so their results are just put together
+        # (an error from a packing process takes the place of one of the results, so it's raised before the
+        # processes are joined)
+        partition_results = [result_queue.get() for _ in workers]
+        for result in partition_results:
+            if isinstance(result, Exception):
+                raise result
+        for worker in workers:
+            worker.join()
+
+        if bloom_size is not None:
+            false_positive_rate = sum(rate for _, rate in partition_results) / num_workers
+            print("Bloom filter: ", partition_bloom_size * num_workers, " counters, estimated false-positive rate ",
+                  round(false_positive_rate, 6))
+        return tuple(np.concatenate(arrays) for arrays in zip(*[counts for counts, _ in partition_results]))
+    except IOError:
+        print("Could not read file: ", reads_fn)
+        return None
+
+# packed version of form_de_bruijn_graph, for packed kmers of length k (from encode_kmers)
+# the nodes are the packed (k-1)-mers, in a sorted array of uint64s, so a node is found with a binary search
+# the edges of each node are kept in one uint8: the low 4 bits have a bit set for each base that can come after the
+# node (its out-edges), and the high 4 bits have a bit set for each base that can come before it (its in-edges)
+# since each edge is a bit, duplicate edges are removed for free
+def form_packed_de_bruijn_graph(packed_kmers, k):
+    # for each k-mer:
+    #   prefix -> suffix
+    prefixes = packed_kmers >> np.uint64(2)
+    suffixes = packed_kmers & np.uint64((1 << (2 * (k - 1))) - 1)
+    nodes = np.unique(np.concatenate((prefixes, suffixes)))
+
+    edge_masks = np.zeros(len(nodes), dtype=np.uint8)
+    last_bases = (packed_kmers & np.uint64(3)).astype(np.uint8)
+    first_bases = (packed_kmers >> np.uint64(2 * (k - 1))).astype(np.uint8)
+    np.bitwise_or.at(edge_masks, np.searchsorted(nodes, prefixes), np.left_shift(1, last_bases, dtype=np.uint8))
+    np.bitwise_or.at(edge_masks, np.searchsorted(nodes, suffixes), np.left_shift(16, first_bases, dtype=np.uint8))
+
+    return nodes, edge_masks
+
+# packed version of get_node_degrees: returns arrays of the in-degree and out-degree of each node
+def get_packed_node_degrees(edge_masks):
+    return MASK_DEGREES[edge_masks >> 4], MASK_DEGREES[edge_masks & 15]
+
+# returns the indices of the nodes that the node at node_index has out-edges to (in order of their last base)
+# node_mask has the low 2 * (k - 1) bits set, so that shifting a base into a node drops its first base
+def get_packed_successors(node_index, nodes, edge_masks, node_mask):
+    # the successors are looked up as uint64s, since numpy would compare a python int to every node as a float
+    shifted_node = (int(nodes[node_index]) << 2) & node_mask
+    return [int(np.searchsorted(nodes, np.uint64(shifted_node | base))) for base in range(4)
+            if (edge_masks[node_index] >> base) & 1]
+
+# returns all maximal non-branching paths in De Bruijn Graph, in one linear pass over the nodes
+# the paths are yielded one at a time as soon as they're found, so the contigs can be formed and written out without
+# keeping every path around
 def find_paths(adjacency_list):
 
     # find in-degrees and out-degrees for each node
     node_degrees = get_node_degrees(adjacency_list)
 
-    # find maximal non-branching paths
+    # isolated cycles won't contain any of the nodes traversed in paths, so the 1-in-1-out nodes on the paths are
+    # marked as visited (instead of removing them from the graph one by one)
+    # each node gets an id, and the visited nodes are marked in a bitmap with one bit per id, as in find_packed_paths
+    node_ids = {node: i for i, node in enumerate(node_degrees)}
+    visited = bytearray((len(node_ids) + 7) // 8)
 
-    # Paths ← empty list
-    paths = []
+    # find maximal non-branching paths
 
     # for each node v in graph
-    for v in list(node_degrees.keys()):
+    for v in node_degrees:
         # if v is not a 1-in-1-out node
         if node_degrees[v] != [1,1]:
             # if out(v) > 0
@@ -121,74 +625,92 @@ def find_paths(adjacency_list):
                     non_branching_path = [v,w]
                     # while w is a 1-in-1-out node
                     while node_degrees[w] == [1,1]:
+                        w_id = node_ids[w]
+                        visited[w_id >> 3] |= 1 << (w_id & 7)
                         # extend NonBranchingPath by the edge (w, u)
                         u = adjacency_list[w][0]
                         non_branching_path.append(u)
                         # w ← u
                         w = u
                     # add NonBranchingPath to the set Paths
-                    paths.append(non_branching_path)
+                    yield non_branching_path
 
     # for each isolated cycle Cycle in Graph
     #   add Cycle to Paths
 
-    # isolated cycles won't contain any of the nodes traversed in paths, so remove those nodes from our graph
-    for path in paths:
-        for node in path:
-            if node in adjacency_list:
-                del adjacency_list[node]
-
-    # remove any nodes that aren't 1-in-1-out nodes
-    for node in list(adjacency_list.keys()):
-        # if node isn't a 1-in-1-out node
-        if node_degrees[node] != [1,1]:
-            del adjacency_list[node]
-
-    # adjacency_list now consists of only 1-in-1-out nodes that weren't traversed in any of our other paths
-    # while adjacency_list is not empty
-    while adjacency_list:
-        # select any node as the starting node for our cycle
-        start_node = list(adjacency_list.keys())[0]
-        
-        curr_node = start_node
-        next_node = adjacency_list[start_node][0]
+    # every 1-in-1-out node that wasn't visited is on an isolated cycle, so each one that's still unvisited when we
+    # get to it starts a new cycle, which is followed back around to it
+    for start_node in adjacency_list:
+        start_id = node_ids[start_node]
+        if node_degrees[start_node] != [1,1] or (visited[start_id >> 3] >> (start_id & 7)) & 1:
+            continue
 
         cycle = [start_node]
+        visited[start_id >> 3] |= 1 << (start_id & 7)
+        curr_node = adjacency_list[start_node][0]
+        while curr_node != start_node:
+            curr_id = node_ids[curr_node]
+            visited[curr_id >> 3] |= 1 << (curr_id & 7)
+            cycle.append(curr_node)
+            curr_node = adjacency_list[curr_node][0]
 
-        first_time_visiting_start_node = True
-        while curr_node != start_node or first_time_visiting_start_node:
-            first_time_visiting_start_node = False
-
-            # remove curr_node from adjacency_list
-            del adjacency_list[curr_node]
-
-            # add next_node to cycle
-            cycle.append(next_node)
-
-            # update curr_node and next_node
-            curr_node = next_node
-
-            # make sure we haven't reached a dead end
-            if next_node not in adjacency_list:
-                continue
-            next_node = adjacency_list[next_node][0]
-        
         # add our cycle to paths
-        paths.append(cycle)
+        cycle.append(start_node)
+        yield cycle
+
+# packed version of find_paths, for the graph from form_packed_de_bruijn_graph
+# yields the paths as lists of node indices
+# the visited nodes are marked in a bitmap with one bit per node (bit i % 8 of byte i // 8)
+def find_packed_paths(nodes, edge_masks, k):
+    node_mask = (1 << (2 * (k - 1))) - 1
 
-    return paths
+    # find in-degrees and out-degrees for each node
+    in_degrees, out_degrees = get_packed_node_degrees(edge_masks)
+    one_in_one_out = (in_degrees == 1) & (out_degrees == 1)
+
+    # only the 1-in-1-out nodes can be on an isolated cycle, so every other node starts out visited
+    visited = bytearray(np.packbits(~one_in_one_out, bitorder='little').tobytes())
+
+    # find maximal non-branching paths, starting from each node that isn't a 1-in-1-out node and has out-edges
+    for v in np.flatnonzero(~one_in_one_out & (out_degrees > 0)).tolist():
+        for w in get_packed_successors(v, nodes, edge_masks, node_mask):
+            non_branching_path = [v, w]
+            while one_in_one_out[w]:
+                visited[w >> 3] |= 1 << (w & 7)
+                w = get_packed_successors(w, nodes, edge_masks, node_mask)[0]
+                non_branching_path.append(w)
+            yield non_branching_path
+
+    # each node that's left is on an isolated cycle, so follow the cycle from it back around to it
+    for start_node in np.flatnonzero(one_in_one_out).tolist():
+        if (visited[start_node >> 3] >> (start_node & 7)) & 1:
+            continue
+        cycle = [start_node]
+        curr_node = start_node
+        while True:
+            visited[curr_node >> 3] |= 1 << (curr_node & 7)
+            curr_node = get_packed_successors(curr_node, nodes, edge_masks, node_mask)[0]
+            cycle.append(curr_node)
+            if curr_node == start_node:
+                break
+        yield cycle
 
 # returns the contigs formed by the maximal non-branching paths
+# the contigs are yielded as each path comes in (see find_paths)
 def form_contigs(paths):
-    contigs = []
-
     for path in paths:
         contig = path[0] # add the entire first kmer to the contig
         for i in range(1, len(path)):
             contig += path[i][-1] # add the end of each kmer to the contig
-        contigs.append(contig)
+        yield contig
 
-    return contigs
+# packed version of form_contigs, for the paths of node indices from find_packed_paths
+def form_packed_contigs(paths, nodes, k):
+    for path in paths:
+        # add the entire first node to the contig, then the last base of each node after it
+        contig = decode_node(nodes[path[0]], k - 1)
+        contig += ''.join(CODE_TO_BASE[int(nodes[node]) & 3] for node in path[1:])
+        yield contig
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='basic_assembly.py takes in data for homework assignment 3 consisting '
@@ -204,53 +726,127 @@ if __name__ == "__main__":
                              '1) spectrum_A_1_chr_1 for 10K spectrum reads practice data\n'
                              '2) practice_A_2_chr_1 for 10k normal reads practice data\n'
                              '3) hw3all_A_3_chr_1 for project 3 for-credit data\n')
+    parser.add_argument('--graph', choices=['dict', 'packed'], default='dict', dest='graph',
+                        help='How the de Bruijn graph is stored: as a dictionary of (k-1)-mer strings (default), or '
+                             'as a sorted array of (k-1)-mers packed into uint64s with a 4-bit mask of out-edges and '
+                             'a 4-bit mask of in-edges for each node (packed), which takes a few bytes per node.')
+    parser.add_argument('--packedKmers', action='store_true', dest='packed_kmers',
+                        help='Stream the reads file in chunks and count the kmers as 2-bit packed integers with a '
+                             'NumPy sort, without making a string for every kmer.')
+    parser.add_argument('--chunkSize', type=int, default=PACKED_CHUNK_SIZE, dest='chunk_size',
+                        help='With --packedKmers, the number of read pairs in each chunk of the reads file.')
+    parser.add_argument('--workers', type=int, default=1, dest='workers',
+                        help='With --packedKmers, the number of worker processes to pack the kmers of the reads '
+                             'with, and the number to count them with. The kmers are split across the counting '
+                             'workers by their hash, and each one counts its own share.')
+    parser.add_argument('--bloomSize', type=int, default=None, dest='bloom_size',
+                        help='With --packedKmers, read the reads file twice: first adding the kmers to a counting '
+                             'Bloom filter with this many one-byte counters, then only counting the kmers that the '
+                             'filter has seen more than once, so that the error kmers that are only seen once never '
+                             'take up space in the counts. The estimated false-positive rate of the filter is printed.')
+    parser.add_argument('--clipTips', type=int, default=None, dest='clip_tips',
+                        help='Before finding the paths, remove dead-end tips of at most this many kmers that branch '
+                             'off the rest of the graph (2 * k is a good start).')
+    parser.add_argument('--popBubbles', type=int, default=None, dest='pop_bubbles',
+                        help='Before finding the paths, pop bubbles of paths with at most this many kmers between '
+                             'the same two nodes, keeping only the path with the highest average kmer frequency '
+                             '(2 * k is a good start).')
     args = parser.parse_args()
+    if args.chunk_size < 1:
+        parser.error('--chunkSize must be at least 1')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.bloom_size is not None and (args.bloom_size < 1 or not args.packed_kmers):
+        parser.error('--bloomSize must be at least 1, and needs --packedKmers')
+    for option, value in (('--clipTips', args.clip_tips), ('--popBubbles', args.pop_bubbles)):
+        if value is not None and (value < 1 or args.graph != 'dict'):
+            parser.error(option + ' must be at least 1, and needs --graph dict')
     reads_fn = args.reads_file
 
-    input_reads = parse_reads_file(reads_fn)
-    if input_reads is None:
-        sys.exit(1)
+    # with --packedKmers, the reads are parsed chunk by chunk in STEPS 1-3 instead
+    if not args.packed_kmers:
+        input_reads = parse_reads_file(reads_fn)
+        if input_reads is None:
+            sys.exit(1)
 
     """
     TODO: Call functions to do the actual assembly here
     """
 
-    ###### STEP 1: CONVERT FROM READ-PAIRS TO SINGLE READS ######
-    # in order to avoid issues with variable length read pairs, we will
-    # consider each part of the read pair as its own independent read
-    # therefore, we "flatten" the input_reads list so each read is its own entry
-    input_reads = [read for read_pair in input_reads for read in read_pair]
-
-    ###### STEP 2: BREAK DOWN READS INTO SMALLER K-MERS ######
-    # currently, our reads are 50-mers
-    # we will use k = 25 to break them down into 25-mers
-    kmers = break_into_kmers(input_reads, 25)
-
-    ###### STEP 3: REMOVE INFREQUENT KMERS ######
-    # any kmer with low frequency has a high probability of being erroneous
+    if args.packed_kmers:
+        ###### STEPS 1-3: STREAM THE READS, COUNT THE K-MERS AS PACKED INTEGERS AND REMOVE INFREQUENT K-MERS ######
+        # any kmers with a frequency <= 3 are removed (we assume they're erroneous), by each worker for its own kmers
+        # with --bloomSize, the kmers that are only seen once are screened out before they're counted
+        frequent_kmers = get_frequent_kmers_packed(reads_fn, KMER_SIZE, args.chunk_size, 4, args.workers,
+                                                   args.bloom_size)
+        if frequent_kmers is None:
+            sys.exit(1)
+        packed_kmers, kmer_counts = frequent_kmers
+    else:
+        ###### STEP 1: CONVERT FROM READ-PAIRS TO SINGLE READS ######
+        # in order to avoid issues with variable length read pairs, we will
+        # consider each part of the read pair as its own independent read
+        # therefore, we "flatten" the input_reads list so each read is its own entry
+        input_reads = [read for read_pair in input_reads for read in read_pair]
+
+        ###### STEP 2: BREAK DOWN READS INTO SMALLER K-MERS ######
+        # currently, our reads are 50-mers
+        # we will use k = KMER_SIZE = 25 to break them down into 25-mers
+        kmers = break_into_kmers(input_reads, KMER_SIZE)
+
+        ###### STEP 3: REMOVE INFREQUENT KMERS ######
+        # any kmer with low frequency has a high probability of being erroneous
     
-    # first, map each kmer to the amount of times it occurs
-    kmer_to_frequency = get_kmer_frequencies(kmers)
+        # first, map each kmer to the amount of times it occurs
+        kmer_to_frequency = get_kmer_frequencies(kmers)
 
-    # then, remove any kmers with a frequency <= 3 - we assume they're erroneous
-    kmer_to_frequency = {kmer: freq for kmer, freq in kmer_to_frequency.items() if freq > 3}
+        # then, remove any kmers with a frequency <= 3 - we assume they're erroneous
+        kmer_to_frequency = {kmer: freq for kmer, freq in kmer_to_frequency.items() if freq > 3}
 
     ###### STEP 4: CONSTRUCT DE BRUIJN GRAPH ######
     # adjacency list representation of the de Bruijn graph
     # Note: we also remove duplicate edges from the de Bruijn graph
-    adjacency_list = form_de_bruijn_graph(kmer_to_frequency)
-
-    ###### STEP 5: FIND ALL MAXIMAL NON-BRANCHING PATHS IN DE BRUIJN GRAPH ######
-    paths = find_paths(adjacency_list)
-
-    ###### STEP 6: FORM CONTIGS FROM MAXIMAL NON-BRANCHING PATHS ######
-    contigs = form_contigs(paths)
+    # with --graph packed, the nodes are packed into uint64s and the edges into bit masks instead
+    if args.graph == 'packed':
+        if not args.packed_kmers:
+            packed_kmers = encode_kmers(list(kmer_to_frequency.keys()), KMER_SIZE)
+        nodes, edge_masks = form_packed_de_bruijn_graph(packed_kmers, KMER_SIZE)
+    else:
+        if args.packed_kmers:
+            kmer_to_frequency = dict(zip(decode_kmers(packed_kmers, KMER_SIZE), kmer_counts.tolist()))
+        adjacency_list = form_de_bruijn_graph(kmer_to_frequency)
+
+    ###### STEP 5: SIMPLIFY THE DE BRUIJN GRAPH ######
+    # errors that made it past STEP 3 leave short dead-end tips and small bubbles in the graph, which split up the
+    # paths around them, so those are removed first (with --clipTips and --popBubbles)
+    if args.clip_tips is not None or args.pop_bubbles is not None:
+        predecessors = get_predecessors(adjacency_list)
+        num_tips = 0 if args.clip_tips is None else clip_tips(adjacency_list, predecessors, args.clip_tips)
+        num_popped = 0 if args.pop_bubbles is None else pop_bubbles(adjacency_list, predecessors, kmer_to_frequency,
+                                                                    args.pop_bubbles)
+        print("Simplified graph: ", num_tips, " tips clipped, ", num_popped, " bubble paths popped")
+
+    ###### STEP 6: FIND ALL MAXIMAL NON-BRANCHING PATHS IN DE BRUIJN GRAPH ######
+    # the paths (and the contigs in STEP 7) are only found as the contigs are written out, one at a time
+    if args.graph == 'packed':
+        paths = find_packed_paths(nodes, edge_masks, KMER_SIZE)
+    else:
+        paths = find_paths(adjacency_list)
+
+    ###### STEP 7: FORM CONTIGS FROM MAXIMAL NON-BRANCHING PATHS ######
+    if args.graph == 'packed':
+        contigs = form_packed_contigs(paths, nodes, KMER_SIZE)
+    else:
+        contigs = form_contigs(paths)
 
     output_fn = args.output_file
     zip_fn = output_fn + '.zip'
     with open(output_fn, 'w') as output_file:
         output_file.write('>' + args.output_header + '\n')
         output_file.write('>ASSEMBLY\n')
-        output_file.write('\n'.join(contigs))
+        for i, contig in enumerate(contigs):
+            if i > 0:
+                output_file.write('\n')
+            output_file.write(contig)
     with zipfile.ZipFile(zip_fn, 'w') as myzip:
         myzip.write(output_fn)
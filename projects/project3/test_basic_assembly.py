@@ -0,0 +1,166 @@
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+import basic_assembly
+
+
+# returns a random sequence of length bases
+def random_sequence(length):
+    return ''.join(random.choice('ACGT') for _ in range(length))
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        random.seed(23)
+        cls.k = basic_assembly.KMER_SIZE
+        kmers = [random_sequence(cls.k) for _ in range(300)]
+        cls.singletons = basic_assembly.encode_kmers(kmers[:100], cls.k)
+        cls.repeated = basic_assembly.encode_kmers(kmers[100:], cls.k)
+        # the repeated kmers are seen 2-4 times each, spread over a few chunks
+        repeats = np.concatenate([cls.repeated, cls.repeated] + [cls.repeated[::2], cls.repeated[::3]])
+        all_kmers = np.random.default_rng(23).permutation(np.concatenate((cls.singletons, repeats)))
+        cls.chunks = np.array_split(all_kmers, 5)
+
+    # with a filter big enough to have no collisions here, the kmers seen once are dropped and the kmers seen more
+    # than once are kept
+    def test_singletons_dropped_and_repeated_kept(self):
+        bloom_filter = basic_assembly.create_bloom_filter(1 << 20)
+        for chunk in self.chunks:
+            basic_assembly.add_to_bloom_filter(bloom_filter, chunk)
+
+        min_count = basic_assembly.BLOOM_MIN_COUNT
+        self.assertFalse(basic_assembly.check_bloom_filter(bloom_filter, self.singletons, min_count).any())
+        self.assertTrue(basic_assembly.check_bloom_filter(bloom_filter, self.repeated, min_count).all())
+        self.assertLess(basic_assembly.get_bloom_false_positive_rate(bloom_filter), 1e-6)
+
+    # the counters stop at 255 instead of wrapping around to 0
+    def test_counters_saturate(self):
+        bloom_filter = basic_assembly.create_bloom_filter(1000)
+        kmer = self.repeated[:1]
+        for _ in range(3):
+            basic_assembly.add_to_bloom_filter(bloom_filter, np.repeat(kmer, 100))
+        self.assertEqual(sorted(set(bloom_filter.tolist())), [0, 255])
+        self.assertTrue(basic_assembly.check_bloom_filter(bloom_filter, kmer, 255).all())
+
+    # the counts of the kmers that get through the filter are exact, so when the kmers seen once would be filtered
+    # out anyway, the result is the same as without the filter (even with a small, crowded filter)
+    def test_screened_counts_are_exact(self):
+        expected = basic_assembly.count_kmer_chunks(self.chunks, 2)
+        for bloom_size in (1 << 20, 500):
+            with self.subTest(bloom_size=bloom_size):
+                (kmers, counts), false_positive_rate = basic_assembly.count_screened_kmer_chunks(
+                    self.chunks, self.chunks, 2, bloom_size)
+                self.assertEqual(kmers.tolist(), expected[0].tolist())
+                self.assertEqual(counts.tolist(), expected[1].tolist())
+                self.assertTrue(0 <= false_positive_rate <= 1)
+
+    # the whole packed counting of a reads file gives the same frequent kmers with and without the filter, in one
+    # process or split across workers
+    def test_frequent_kmers_with_bloom_filter(self):
+        genome = random_sequence(2000)
+        reads = [genome[start:(start + 50)] for start in range(0, 1950, 7)]
+        # a read with an error, whose kmers over the error are only seen once
+        reads.append(reads[10][:25] + ('A' if reads[10][25] != 'A' else 'C') + reads[10][26:])
+        lines = [','.join(reads[i:(i + 2)]) for i in range(0, len(reads), 2)]
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as reads_file:
+            reads_file.write('>reads_test\n' + '\n'.join(lines) + '\n')
+            reads_fn = reads_file.name
+
+        try:
+            expected = basic_assembly.get_frequent_kmers_packed(reads_fn, self.k, 20, 2)
+            self.assertGreater(len(expected[0]), 0)
+            for num_workers in (1, 2):
+                with self.subTest(num_workers=num_workers):
+                    kmers, counts = basic_assembly.get_frequent_kmers_packed(reads_fn, self.k, 20, 2, num_workers,
+                                                                             bloom_size=1 << 16)
+                    order = np.argsort(kmers)
+                    self.assertEqual(kmers[order].tolist(), expected[0].tolist())
+                    self.assertEqual(counts[order].tolist(), expected[1].tolist())
+        finally:
+            os.remove(reads_fn)
+
+
+# returns a base other than base
+def other_base(base):
+    return 'A' if base != 'A' else 'C'
+
+# returns the kmers of length k of each sequence
+def get_kmers(sequences, k):
+    return [sequence[i:(i + k)] for sequence in sequences for i in range(len(sequence) - k + 1)]
+
+# returns the kmers (edges) that are left in a graph
+def get_graph_kmers(adjacency_list):
+    return {outgoing_node + incoming_node[-1] for outgoing_node, incoming_nodes in adjacency_list.items()
+            for incoming_node in incoming_nodes}
+
+
+class TestGraphSimplification(unittest.TestCase):
+
+    K = 12
+
+    def setUp(self):
+        random.seed(25)
+        self.backbone = random_sequence(120)
+        # no node of the backbone is repeated, so the backbone alone is one non-branching path
+        self.assertEqual(len(set(get_kmers([self.backbone], self.K - 1))), len(self.backbone) - self.K + 2)
+
+    # returns the adjacency list and predecessors of the de Bruijn graph of kmer_to_frequency
+    def form_graph(self, kmer_to_frequency):
+        adjacency_list = basic_assembly.form_de_bruijn_graph(kmer_to_frequency)
+        return adjacency_list, basic_assembly.get_predecessors(adjacency_list)
+
+    # tips of 3 kmers (one leaving the backbone and one joining it) are removed with a limit of 3 but not 2, a tip
+    # of 10 kmers is longer than the limit and kept, and so is a short path that doesn't join the rest of the graph
+    def test_clip_tips(self):
+        k = self.K
+        # each tip's first base off the backbone is a different base from the backbone's
+        short_tip_out = self.backbone[50:(50 + k - 1)] + other_base(self.backbone[50 + k - 1]) + 'TT'
+        short_tip_in = 'GG' + other_base(self.backbone[19]) + self.backbone[20:(20 + k - 1)]
+        long_tip_out = self.backbone[35:(35 + k - 1)] + other_base(self.backbone[35 + k - 1]) + random_sequence(9)
+        island = random_sequence(k + 3)
+        kmer_to_frequency = {kmer: 5 for kmer in get_kmers([self.backbone, short_tip_out, short_tip_in,
+                                                             long_tip_out, island], k)}
+        adjacency_list, predecessors = self.form_graph(kmer_to_frequency)
+
+        self.assertEqual(basic_assembly.clip_tips(adjacency_list, predecessors, 2), 0)
+        self.assertEqual(get_graph_kmers(adjacency_list), set(kmer_to_frequency))
+
+        self.assertEqual(basic_assembly.clip_tips(adjacency_list, predecessors, 3), 2)
+        self.assertEqual(get_graph_kmers(adjacency_list), set(get_kmers([self.backbone, long_tip_out, island], k)))
+        self.assertEqual(predecessors, basic_assembly.get_predecessors(adjacency_list))
+
+        # with a limit of 10, the long tip goes too
+        self.assertEqual(basic_assembly.clip_tips(adjacency_list, predecessors, 10), 1)
+        self.assertEqual(sorted(basic_assembly.form_contigs(basic_assembly.find_paths(adjacency_list))),
+                         sorted([self.backbone, island]))
+
+    # a bubble from a 1-base difference is popped toward the branch with the higher kmer frequencies, whichever one
+    # that is, leaving one contig
+    def test_pop_bubbles(self):
+        k = self.K
+        variant = self.backbone[:40] + other_base(self.backbone[40]) + self.backbone[41:]
+        for backbone_frequency, variant_frequency in ((10, 2), (3, 12)):
+            with self.subTest(backbone_frequency=backbone_frequency, variant_frequency=variant_frequency):
+                kmer_to_frequency = {kmer: variant_frequency for kmer in get_kmers([variant], k)}
+                kmer_to_frequency.update({kmer: backbone_frequency for kmer in get_kmers([self.backbone], k)})
+                adjacency_list, predecessors = self.form_graph(kmer_to_frequency)
+                self.assertEqual(len(list(basic_assembly.find_paths(adjacency_list))), 4)
+
+                # the branches have k kmers each, so a limit under that leaves the bubble alone
+                self.assertEqual(basic_assembly.pop_bubbles(adjacency_list, predecessors, kmer_to_frequency, k - 1),
+                                 0)
+                self.assertEqual(basic_assembly.pop_bubbles(adjacency_list, predecessors, kmer_to_frequency, k), 1)
+                expected = self.backbone if backbone_frequency > variant_frequency else variant
+                self.assertEqual(get_graph_kmers(adjacency_list), set(get_kmers([expected], k)))
+                self.assertEqual(list(basic_assembly.form_contigs(basic_assembly.find_paths(adjacency_list))),
+                                 [expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -37,12 +37,35 @@ for outgoing_node, incoming_nodes in adjacency_list.items():
             node_degrees[incoming_node] = [1, 0]
 
 # find maximal non-branching paths
-
-# Paths ← empty list
-paths = []
+# each path is turned into a contig and printed as soon as it's found (STEPS 3-4), in one linear pass over the
+# nodes, instead of collecting all of the paths first
+
+# isolated cycles won't contain any of the nodes traversed in paths, so the 1-in-1-out nodes on the paths are marked
+# as visited (instead of removing them from adjacency_list one by one)
+# each node gets an id, and the visited nodes are marked in a bitmap with one bit per id (bit i % 8 of byte i // 8)
+node_ids = {node: i for i, node in enumerate(node_degrees)}
+visited = bytearray((len(node_ids) + 7) // 8)
+
+# marks a node as visited
+def visit(node):
+    node_id = node_ids[node]
+    visited[node_id >> 3] |= 1 << (node_id & 7)
+
+# returns whether a node was visited
+def is_visited(node):
+    node_id = node_ids[node]
+    return (visited[node_id >> 3] >> (node_id & 7)) & 1
+
+# forms the contig of a maximal non-branching path and prints it (STEPS 3-4 below)
+# (called on each path as soon as it's found)
+def print_contig(path):
+    contig = path[0] # add the entire first kmer to the contig
+    for i in range(1, len(path)):
+        contig += path[i][-1] # add the end of each kmer to the contig
+    print(contig, end=' ')
 
 # for each node v in graph
-for v in list(node_degrees.keys()):
+for v in node_degrees:
     # if v is not a 1-in-1-out node
     if node_degrees[v] != [1,1]:
         # if out(v) > 0
@@ -53,72 +76,38 @@ for v in list(node_degrees.keys()):
                 non_branching_path = [v,w]
                 # while w is a 1-in-1-out node
                 while node_degrees[w] == [1,1]:
+                    visit(w)
                     # extend NonBranchingPath by the edge (w, u)
                     u = adjacency_list[w][0]
                     non_branching_path.append(u)
                     # w ← u
                     w = u
                 # add NonBranchingPath to the set Paths
-                paths.append(non_branching_path)
+                print_contig(non_branching_path)
 
 # for each isolated cycle Cycle in Graph
 #   add Cycle to Paths
 
-# isolated cycles won't contain any of the nodes traversed in paths, so remove those nodes from our graph
-for path in paths:
-    for node in path:
-        if node in adjacency_list:
-            del adjacency_list[node]
-
-# remove any nodes that aren't 1-in-1-out nodes
-for node in list(adjacency_list.keys()):
-    # if node isn't a 1-in-1-out node
-    if node_degrees[node] != [1,1]:
-        del adjacency_list[node]
-
-# adjacency_list now consists of only 1-in-1-out nodes that weren't traversed in any of our other paths
-# while adjacency_list is not empty
-while adjacency_list:
-    # select any node as the starting node for our cycle
-    start_node = list(adjacency_list.keys())[0]
-    
-    curr_node = start_node
-    next_node = adjacency_list[start_node][0]
+# every 1-in-1-out node that wasn't visited is on an isolated cycle, so each one that's still unvisited when we get
+# to it starts a new cycle, which is followed back around to it
+for start_node in adjacency_list:
+    if node_degrees[start_node] != [1,1] or is_visited(start_node):
+        continue
 
     cycle = [start_node]
+    visit(start_node)
+    curr_node = adjacency_list[start_node][0]
+    while curr_node != start_node:
+        visit(curr_node)
+        cycle.append(curr_node)
+        curr_node = adjacency_list[curr_node][0]
 
-    first_time_visiting_start_node = True
-    while curr_node != start_node or first_time_visiting_start_node:
-        first_time_visiting_start_node = False
-
-        # remove curr_node from adjacency_list
-        del adjacency_list[curr_node]
-
-        # add next_node to cycle
-        cycle.append(next_node)
-
-        # update curr_node and next_node
-        curr_node = next_node
-
-        # make sure we haven't reached a dead end
-        if next_node not in adjacency_list:
-            continue
-        next_node = adjacency_list[next_node][0]
-    
     # add our cycle to paths
-    paths.append(cycle)
+    cycle.append(start_node)
+    print_contig(cycle)
 
-###### STEP 3: FORM CONTIGS FROM MAXIMAL NON-BRANCHING PATHS ######
+###### STEPS 3-4: FORM AND PRINT THE CONTIGS ######
 
-contigs = []
-for path in paths:
-    contig = path[0] # add the entire first kmer to the contig
-    for i in range(1, len(path)):
-        contig += path[i][-1] # add the end of each kmer to the contig
-    contigs.append(contig)
-
-###### STEP 4: PRINT CONTIGS ######
-
-for contig in contigs:
-    print(contig, end=' ')
+# each contig was already formed and printed by print_contig as soon as its path was found, so only the line of
+# contigs is ended here
 print('')